@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.forms.models import BaseInlineFormSet
 
 from .models import Component
 from .models import Part
@@ -7,17 +8,43 @@ from .models import Record
 from .models import Material
 #from .models import Mounting
 
+# Records shown on a bicycle's page, all of them are on the record changelist
+BICYCLE_RECORDS = 20
+
+# Only the latest records, the formset can't be sliced before it is filtered by bicycle
+class LatestRecordsFormSet(BaseInlineFormSet):
+    def get_queryset(self):
+        # called for every form
+        if not hasattr(self, '_latest'):
+            self._latest = super().get_queryset()[:BICYCLE_RECORDS]
+        return self._latest
+
 class RecordInline(admin.TabularInline):
     model = Record
+    formset = LatestRecordsFormSet
     extra = 1
-    ordering = ["-date"]
+    ordering = ["-date", "-id"]
+    verbose_name_plural = "Latest records"
+    show_change_link = True
 
 class BicycleAdmin(admin.ModelAdmin):
     inlines = [RecordInline]
     ordering = ["name"]
+    search_fields = ["name"]
 
 admin.site.register(Bicycle, BicycleAdmin)
 
+class RecordAdmin(admin.ModelAdmin):
+    list_display = ('date', 'bicycle', 'km')
+    list_filter = ('bicycle',)
+    list_select_related = ('bicycle',)
+    date_hierarchy = 'date'
+    ordering = ["-date", "-id"]
+    search_fields = ["bicycle__name", "date"]
+    autocomplete_fields = ["bicycle"]
+
+admin.site.register(Record, RecordAdmin)
+
 
 class PartInline(admin.TabularInline):
     model = Part
@@ -26,11 +53,37 @@ class PartInline(admin.TabularInline):
 class ComponentAdmin(admin.ModelAdmin):
     inlines = [PartInline]
     ordering = ["name"]
+    search_fields = ["name"]
     
 admin.site.register(Component, ComponentAdmin)
 
+class PartAdmin(admin.ModelAdmin):
+    list_display = ('name', 'component', 'wear_limit')
+    list_filter = ('component',)
+    list_select_related = ('component',)
+    ordering = ["component__name", "name"]
+    search_fields = ["name", "component__name"]
+    autocomplete_fields = ["component"]
+
+admin.site.register(Part, PartAdmin)
+
 class MaterialAdmin(admin.ModelAdmin):
-    list_display =('name', 'manufactor', 'size', 'mounted_in_bicycle')
+    list_display =('name', 'manufactor', 'size', 'mounted_in_bicycle', 'mileage', 'cost_per_km')
+    list_filter = ('state', 'part__component', 'manufactor')
+    search_fields = ["name", "manufactor", "size", "part__name"]
+    # select boxes would contain every record, twice
+    autocomplete_fields = ["part", "mount_record", "dismount_record"]
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_related().with_cost_per_km()
+    
+    def mileage(self, material):
+        return material.mileage
+    mileage.admin_order_field = 'mileage'
+    
+    def cost_per_km(self, material):
+        return material.cost_per_km
+    cost_per_km.admin_order_field = 'cost_per_km'
     
 admin.site.register(Material, MaterialAdmin)
 
@@ -3,3 +3,17 @@ from django.apps import AppConfig
 
 class MyequisConfig(AppConfig):
     name = 'myequis'
+
+    def ready(self):
+        # connects the receivers
+        from myequis import signals
+
+        from django.conf import settings
+        from django.core.signals import request_started
+        from myequis import search
+        if getattr(settings, 'MYEQUIS_SEARCH_WARM', False):
+            request_started.connect(search.warm_on_first_request)
+
+        if getattr(settings, 'MYEQUIS_INSTRUMENTATION', False):
+            from myequis import instrumentation
+            instrumentation.install()
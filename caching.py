@@ -0,0 +1,120 @@
+from functools import partial
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+# Cache for rendered tables and query results of the views.
+#
+# Every cached value belongs to one or more scopes, e.g. "bicycle-5" for the data of a
+# bicycle, "fleet" for the list of bicycles, "materials" for the material inventory and
+# "catalog" for the components and parts, "history-5" and "history" for the records of a
+# bicycle and of all bicycles before the current month, "mounts-5" for the mount and dismount
+# dates of a bicycle's materials. The key of a value contains the current version
+# of its scopes. The signal receivers invalidate a scope by setting a new version, so the
+# values of the old version are never read again and just expire.
+# Every value also belongs to the scope "all", to drop everything after bulk changes.
+#
+# Settings:
+#   MYEQUIS_CACHE          cache alias, default 'default'
+#   MYEQUIS_CACHE_TIMEOUT  seconds a value is kept, default one day
+
+PREFIX = 'myequis'
+
+
+def _cache():
+    return caches[getattr(settings, 'MYEQUIS_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'MYEQUIS_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def bicycle_scope(bicycle_id):
+    return "bicycle-{}".format(bicycle_id)
+
+
+# Records of a bicycle before the current month, see distances.py
+def history_scope(bicycle_id):
+    return "history-{}".format(bicycle_id)
+
+
+# Mount and dismount dates of a bicycle's materials, see configuration.py
+def mount_scope(bicycle_id):
+    return "mounts-{}".format(bicycle_id)
+
+
+def _version_key(scope):
+    return "{}:version:{}".format(PREFIX, scope)
+
+
+# Current versions of the scopes, new scopes get one.
+# Versions are random, so a lost version never brings back old values.
+def _versions(cache, scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+# Current versions of the scopes, they change whenever a scope is invalidated.
+# None for a cache that doesn't keep them, e.g. the dummy cache.
+def versions(*scopes):
+    return _versions(_cache(), scopes)
+
+
+# Returns the value of name within the scopes. On a miss, it is computed by producer() and stored,
+# without timeout if permanent. Always computed by a cache that doesn't keep the versions.
+def cached(scopes, name, producer, permanent=False):
+    cache = _cache()
+    versions = _versions(cache, ['all'] + list(scopes))
+    if None in versions:
+        return producer()
+
+    key = "{}:{}:{}".format(PREFIX, name, ":".join(versions))
+
+    value = cache.get(key)
+    if value is not None:
+        _count(cache, 'hits')
+        return value
+
+    _count(cache, 'misses')
+    value = producer()
+    cache.set(key, value, None if permanent else _timeout())
+    return value
+
+
+# Drops the values of the scopes when the current transaction is committed
+def invalidate(*scopes):
+    transaction.on_commit(partial(invalidate_now, *scopes))
+
+
+def invalidate_now(*scopes):
+    _cache().set_many({_version_key(scope): uuid4().hex for scope in scopes}, None)
+
+
+# Hit and miss counters are kept in the cache too, so they are shared by all processes
+# using it. Cache backends without atomic incr may lose some counts.
+def _count(cache, counter):
+    key = "{}:stats:{}".format(PREFIX, counter)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def stats():
+    cache = _cache()
+    return {counter: cache.get("{}:stats:{}".format(PREFIX, counter), 0) for counter in ('hits', 'misses')}
+
+
+def reset_stats():
+    _cache().delete_many(["{}:stats:{}".format(PREFIX, counter) for counter in ('hits', 'misses')])
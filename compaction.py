@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from myequis.models import Bicycle
+from myequis.models import Material
+from myequis.models import Record
+from myequis.models import Tombstone
+from myequis.signals import bicycles_changed, muted
+
+
+# Compaction of old records: daily records are thinned out to weekly ones after WEEKLY_AFTER
+# days and to monthly ones after MONTHLY_AFTER days. Of each week or month, the last record
+# is kept, so the km at the end of every period stay exact and the km in between can be
+# interpolated (see odometer.py).
+#
+# Always kept are the first and the last record of a bicycle and the records materials are
+# mounted or dismounted at.
+
+WEEKLY_AFTER = 365
+MONTHLY_AFTER = 2 * 365
+
+# Records deleted per transaction
+BATCH_SIZE = 1000
+
+
+def _week(day):
+    return day.isocalendar()[:2]
+
+
+def _month(day):
+    return day.year, day.month
+
+
+# Ids of the bicycle's records to delete, in the order of their dates
+def obsolete(bicycle_id, weekly_before, monthly_before):
+    records = Record.objects.select_related(None).filter(bicycle_id=bicycle_id)
+    first = records.order_by('date').values_list('id', flat=True).first()
+    last = records.order_by('-date').values_list('id', flat=True).first()
+
+    referenced = set()
+    for ids in Material.objects.filter(mount_record__bicycle_id=bicycle_id).values_list(
+            'mount_record_id', 'dismount_record_id'):
+        referenced.update(ids)
+    keep = referenced | {first, last}
+
+    # the last record of each period is kept, so a record is obsolete once the next one is
+    # in the same period
+    previous = None
+    rows = records.filter(date__lt=weekly_before).order_by('date').values_list('id', 'date')
+    for id, day in rows.iterator():
+        period = _month if day < monthly_before else _week
+        if previous is not None and previous[2] is period and period(previous[1]) == period(day) \
+                and previous[0] not in keep:
+            yield previous[0]
+        previous = (id, day, period)
+
+
+# Deletes the obsolete records of the bicycles, all without bicycle_ids, in transactions
+# of batch_size records. Returns the number of deleted records per bicycle.
+def compact(bicycle_ids=None, weekly_after=WEEKLY_AFTER, monthly_after=MONTHLY_AFTER,
+            batch_size=BATCH_SIZE, today=None, dry_run=False):
+    today = today or date.today()
+    weekly_before = today - timedelta(days=weekly_after)
+    monthly_before = today - timedelta(days=monthly_after)
+
+    if bicycle_ids is None:
+        bicycle_ids = list(Bicycle.objects.order_by('id').values_list('id', flat=True))
+
+    deleted = {}
+    for bicycle_id in bicycle_ids:
+        ids = list(obsolete(bicycle_id, weekly_before, monthly_before))
+        if dry_run:
+            deleted[bicycle_id] = len(ids)
+            continue
+
+        deleted[bicycle_id] = sum(
+            _delete(bicycle_id, ids[start:start + batch_size]) for start in range(0, len(ids), batch_size))
+
+    return deleted
+
+
+def _delete(bicycle_id, ids):
+    with transaction.atomic():
+        # Locked, so materials can't be mounted at them until they are deleted.
+        # Records mounted at meanwhile are kept.
+        ids = list(Record.objects.select_related(None).select_for_update().filter(id__in=ids).values_list('id', flat=True))
+        referenced = set(Material.objects.filter(mount_record_id__in=ids).values_list('mount_record_id', flat=True))
+        referenced.update(Material.objects.filter(dismount_record_id__in=ids).values_list('dismount_record_id', flat=True))
+        ids = [id for id in ids if id not in referenced]
+
+        # Without the receivers for each record, their work is done once for all below
+        with muted():
+            Record.objects.select_related(None).filter(id__in=ids).delete()
+        Tombstone.objects.bulk_create(Tombstone(model='record', object_id=id) for id in ids)
+        bicycles_changed([bicycle_id])
+
+    return len(ids)
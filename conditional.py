@@ -0,0 +1,38 @@
+from myequis import caching
+from myequis.models import Bicycle
+
+
+# ETags for the conditional GETs of the views (django.views.decorators.http.etag).
+# They are computed before the view runs, so an unchanged page is answered with 304
+# without loading its data or rendering its template.
+#
+# Bicycle.modified is also updated when a record or material of the bicycle changes
+# (see signals.py), so it covers everything shown on the bicycle's pages but the components
+# and parts of the bicycle page's tree, which are the same for all bicycles.
+# ETags are used instead of Last-Modified, which has a resolution of seconds only.
+
+
+def bicycle_etag(request, bicycle_id):
+    modified = Bicycle.objects.filter(pk=bicycle_id).values_list('modified', flat=True).first()
+    if modified is None:
+        return None
+    return "bicycle-{}-{}".format(bicycle_id, modified.timestamp())
+
+
+# The bicycle page also shows the components and parts. Their cache version changes with
+# them (see caching.py), no query. Without a version, e.g. with the dummy cache, there is no ETag.
+def bicycle_page_etag(request, bicycle_id):
+    catalog = caching.versions('catalog')[0]
+    etag = bicycle_etag(request, bicycle_id)
+    if catalog is None or etag is None:
+        return None
+    return "{}-{}".format(etag, catalog)
+
+
+# The index shows the bicycles table and the materials table, cached in the scopes fleet and
+# materials. Their cache versions change with everything shown (see caching.py), no query.
+def index_etag(request):
+    versions = caching.versions('all', 'fleet', 'materials')
+    if None in versions:
+        return None
+    return "index-{}".format("-".join(versions))
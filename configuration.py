@@ -0,0 +1,139 @@
+from bisect import bisect_right
+from datetime import date
+import threading
+
+from myequis import caching
+from myequis.models import Material
+
+
+# Configuration of a bicycle at a date or within a date range: the materials mounted then.
+#
+# A material is mounted on its bicycle from the date of its mount record until the date of
+# its dismount record (excluded). The intervals are indexed per bicycle and part, sorted by
+# their start together with the latest end of all intervals up to each one. Since a part
+# usually carries one material at a time, a query is a binary search per part.
+#
+# The intervals of a bicycle are loaded on its first query and reloaded after its mount
+# scope got invalidated, i.e. after one of its materials changed or a record changed its date
+# or bicycle (see signals.py). New records and km changes keep them.
+
+# End of the intervals of mounted materials
+OPEN = date.max
+
+
+class PartIntervals:
+
+    # intervals: (start, end, material id), sorted
+    def __init__(self, intervals):
+        self.starts = [start for start, end, id in intervals]
+        self.ends = [end for start, end, id in intervals]
+        self.ids = [id for start, end, id in intervals]
+        # latest end of the intervals up to each one
+        self.reach = []
+        for end in self.ends:
+            self.reach.append(max(end, self.reach[-1]) if self.reach else end)
+
+    # Ids of the materials mounted at any time from first until last
+    def during(self, first, last):
+        ids = []
+        position = bisect_right(self.starts, last) - 1
+        while position >= 0 and self.reach[position] > first:
+            if self.ends[position] > first:
+                ids.append(self.ids[position])
+            position -= 1
+        return ids[::-1]
+
+
+class BicycleIntervals:
+
+    # rows: material id, part id, mount date, dismount date or None
+    def __init__(self, rows):
+        parts = {}
+        for id, part_id, start, end in rows:
+            parts.setdefault(part_id, []).append((start, end or OPEN, id))
+        self.parts = {part_id: PartIntervals(sorted(intervals)) for part_id, intervals in parts.items()}
+
+    # part id: ids of the materials mounted at any time from first until last
+    def during(self, first, last):
+        mounted = {}
+        for part_id, intervals in self.parts.items():
+            ids = intervals.during(first, last)
+            if ids:
+                mounted[part_id] = ids
+        return mounted
+
+    def at(self, day):
+        return self.during(day, day)
+
+
+class ConfigurationIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # bicycle id: cache versions when loaded, BicycleIntervals
+        self.bicycles = {}
+
+    def intervals(self, bicycle_id):
+        versions = caching.versions('all', caching.mount_scope(bicycle_id))
+
+        with self.lock:
+            loaded = self.bicycles.get(bicycle_id)
+            if loaded is not None and loaded[0] == versions and None not in versions:
+                return loaded[1]
+
+        rows = Material.objects.filter(mount_record__bicycle_id=bicycle_id).values_list(
+            'id', 'part_id', 'mount_record__date', 'dismount_record__date')
+        intervals = BicycleIntervals(rows)
+
+        with self.lock:
+            self.bicycles[bicycle_id] = (versions, intervals)
+        return intervals
+
+
+index = ConfigurationIndex()
+
+
+def _materials(mounted):
+    materials = Material.objects.with_related().in_bulk(
+        [id for ids in mounted.values() for id in ids])
+    return sorted((materials[id] for ids in mounted.values() for id in ids if id in materials),
+                  key=lambda material: (material.part.display_long_name() if material.part else '',
+                                        material.mount_record.date))
+
+
+# Materials mounted on the bicycle at day, ordered by part
+def mounted_at(bicycle_id, day):
+    return _materials(index.intervals(bicycle_id).at(day))
+
+
+# Materials mounted on the bicycle at any time from first until last, ordered by part and mount date
+def mounted_during(bicycle_id, first, last):
+    return _materials(index.intervals(bicycle_id).during(first, last))
+
+
+# Changes of the bicycle's configuration from one day to another:
+# (part, materials mounted only before, materials mounted only after) per changed part
+def changes(bicycle_id, before, after):
+    intervals = index.intervals(bicycle_id)
+    old = intervals.at(before)
+    new = intervals.at(after)
+
+    changed = {}
+    for part_id in set(old) | set(new):
+        removed = [id for id in old.get(part_id, []) if id not in new.get(part_id, [])]
+        added = [id for id in new.get(part_id, []) if id not in old.get(part_id, [])]
+        if removed or added:
+            changed[part_id] = (removed, added)
+
+    materials = Material.objects.with_related().in_bulk(
+        [id for removed, added in changed.values() for id in removed + added])
+    result = []
+    for removed, added in changed.values():
+        removed = [materials[id] for id in removed if id in materials]
+        added = [materials[id] for id in added if id in materials]
+        part = (removed + added)[0].part if removed + added else None
+        result.append((part, removed, added))
+    return sorted(result, key=lambda change: change[0].display_long_name() if change[0] else '')
@@ -0,0 +1,99 @@
+from django.db.models import Max, Min
+from django.db.models.functions import TruncMonth, TruncYear
+from django.utils import timezone
+
+from myequis import caching
+from myequis.models import Record
+
+
+# Distances per month or year of a bicycle or of all bicycles.
+#
+# The database aggregates the records per bicycle and period to their least and greatest km.
+# Since the km never decrease, the distance of a period is its greatest km minus the greatest
+# km of the period before, or minus its least km for the first period.
+#
+# Closed periods are cached without timeout within the history scopes. These are only
+# invalidated by changes of records before the current month (see signals.py), so a new
+# record only makes the current period to be computed again.
+
+PERIODS = {
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+
+# First day of the period containing day
+def period_start(period, day):
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def _next(period, day):
+    if period == 'year':
+        return day.replace(year=day.year + 1)
+    if day.month == 12:
+        return day.replace(year=day.year + 1, month=1)
+    return day.replace(month=day.month + 1)
+
+
+# Least and greatest km per bicycle and period: {bicycle id: [(period, least, greatest)]}
+def _aggregate(records, period):
+    rows = records.select_related(None).annotate(period=PERIODS[period]('date')).values(
+        'bicycle_id', 'period').annotate(least=Min('km'), greatest=Max('km')).order_by('bicycle_id', 'period')
+
+    bicycles = {}
+    for row in rows:
+        bicycles.setdefault(row['bicycle_id'], []).append((row['period'], int(row['least']), int(row['greatest'])))
+    return bicycles
+
+
+# Distances of the closed periods before start:
+# {bicycle id: ({period: km}, greatest km before start)}
+def _history(records, period, start):
+    history = {}
+    for bicycle_id, periods in _aggregate(records.filter(date__lt=start), period).items():
+        distances = {}
+        previous = None
+        for day, least, greatest in periods:
+            distances[day] = greatest - (least if previous is None else previous)
+            previous = greatest
+        history[bicycle_id] = (distances, previous)
+    return history
+
+
+# Distances per period, [(first day of the period, km)] from the first record up to today.
+# Of all bicycles without bicycle_id.
+def per_period(period='month', bicycle_id=None, today=None):
+    start = period_start(period, today or timezone.localdate())
+
+    records = Record.objects.all()
+    if bicycle_id is not None:
+        records = records.filter(bicycle_id=bicycle_id)
+        scope = caching.history_scope(bicycle_id)
+    else:
+        scope = 'history'
+
+    history = caching.cached(
+        [scope], "distances:{}:{}:{}".format(bicycle_id, period, start),
+        lambda: _history(records, period, start), permanent=True)
+    current = _aggregate(records.filter(date__gte=start), period)
+
+    totals = {}
+    for bicycle_id in set(history) | set(current):
+        closed, previous = history.get(bicycle_id, ({}, None))
+        for day, km in closed.items():
+            totals[day] = totals.get(day, 0) + km
+        for day, least, greatest in current.get(bicycle_id, []):
+            totals[day] = totals.get(day, 0) + greatest - (least if previous is None else previous)
+
+    if not totals:
+        return []
+
+    # periods without records too
+    result = []
+    day = min(totals)
+    while day <= max(start, max(totals)):
+        result.append((day, totals.get(day, 0)))
+        day = _next(period, day)
+    return result
@@ -0,0 +1,80 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from myequis.models import Material
+from myequis.models import Record
+
+
+# Rows fetched from the database at once
+CHUNK_SIZE = 2000
+
+# Same format as read by the import_records command
+RECORD_FIELDS = ['bicycle', 'date', 'km']
+
+# Column name and the material's value
+MATERIAL_COLUMNS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('manufactor', 'manufactor'),
+    ('size', 'size'),
+    ('price', 'price'),
+    ('weight', 'Weight [g]'),
+    ('component', 'part__component__name'),
+    ('part', 'part__name'),
+    ('bicycle', 'mount_record__bicycle__name'),
+    ('mount_date', 'mount_record__date'),
+    ('mount_km', 'mount_record__km'),
+    ('dismount_date', 'dismount_record__date'),
+    ('dismount_km', 'dismount_record__km'),
+    ('mileage', 'mileage'),
+]
+
+MATERIAL_FIELDS = [column for column, value in MATERIAL_COLUMNS]
+
+
+# Pseudo file for csv.writer, returns the written line instead of buffering it
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(fields, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+# Streams rows (tuples in the order of fields) as CSV or NDJSON.
+# The rows are produced while the response is sent, so the first line goes out
+# before the query is finished and memory doesn't depend on the number of rows.
+def stream(fields, rows, format, filename):
+    if format == 'ndjson':
+        response = StreamingHttpResponse(_ndjson_lines(fields, rows), content_type='application/x-ndjson')
+        filename += '.ndjson'
+    else:
+        response = StreamingHttpResponse(_csv_lines(fields, rows), content_type='text/csv')
+        filename += '.csv'
+
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def record_rows(bicycle_id):
+    return Record.objects.filter(bicycle_id=bicycle_id).order_by('date').values_list(
+        'bicycle__name', 'date', 'km').iterator(chunk_size=CHUNK_SIZE)
+
+
+def material_rows():
+    return Material.objects.with_mileage().order_by('id').values_list(
+        *(value for column, value in MATERIAL_COLUMNS)).iterator(chunk_size=CHUNK_SIZE)
@@ -0,0 +1,129 @@
+from datetime import date, timedelta
+import random
+
+from django.db import transaction
+from django.utils import timezone
+
+from myequis import caching
+from myequis import summary
+from myequis.models import Bicycle
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+from myequis.models import Record
+from myequis.sync import restamp_on_commit
+
+
+# Synthetic data for development and benchmarks.
+
+# Component, its parts and their wear limit in km
+CATALOG = [
+    ("Front Wheel", [("Tube", 4000), ("Tire", 5000), ("Rim Tape", None)]),
+    ("Rear Wheel", [("Tube", 4000), ("Tire", 3500), ("Rim Tape", None)]),
+    ("Drivetrain", [("Chain", 3000), ("Cassette", 9000), ("Chainring", 15000)]),
+    ("Brakes", [("Front Pads", 2500), ("Rear Pads", 3000)]),
+    ("Cockpit", [("Bar Tape", 8000), ("Grips", None)]),
+]
+
+MANUFACTORS = ["Shimano", "SRAM", "Continental", "Schwalbe", "Campagnolo", "KMC", "Michelin"]
+
+
+# Parts of the catalog, created if missing
+def catalog():
+    parts = []
+    for component_name, part_names in CATALOG:
+        component = Component.objects.get_or_create(name=component_name)[0]
+        for part_name, wear_limit in part_names:
+            parts.append(Part.objects.get_or_create(
+                name=part_name, component=component, defaults={'wear_limit': wear_limit})[0])
+    return parts
+
+
+# Creates bicycles with one record per day over the given years up to end,
+# the materials mounted and dismounted on them and unused materials in stock.
+# The same seed creates the same fleet. Returns the new bicycles.
+def generate(bicycles=3, years=1, seed=0, stock=20, end=None):
+    rnd = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=int(years * 365))
+    started = timezone.now()
+
+    with transaction.atomic():
+        parts = catalog()
+        created = []
+        materials = []
+
+        for number in range(bicycles):
+            bicycle = Bicycle.objects.create(name="Bicycle {} ({})".format(number + 1, seed))
+            created.append(bicycle)
+            _records(bicycle, start, end, rnd)
+
+            # id, km of the records in order, to mount and dismount at
+            records = list(Record.objects.filter(bicycle=bicycle).order_by('date').values_list('id', 'km'))
+            for part in parts:
+                materials.extend(_materials(part, bicycle, records, rnd))
+
+        for number in range(stock):
+            materials.append(_material(rnd.choice(parts), rnd))
+
+        Material.objects.bulk_create(materials)
+
+        # bulk_create doesn't send signals
+        for bicycle in created:
+            summary.schedule_refresh(bicycle.id)
+        caching.invalidate('all')
+
+        # for the delta sync, a large fleet takes a while
+        for model in (Bicycle, Component, Part, Record, Material):
+            restamp_on_commit(model.objects.filter(modified__gte=started))
+
+    return created
+
+
+def _records(bicycle, start, end, rnd):
+    # everyday rider with a preferred distance
+    distance = rnd.uniform(10, 60)
+    km = rnd.randint(0, 5000)
+    records = []
+
+    day = start
+    while day <= end:
+        if rnd.random() < 0.6:
+            km += int(rnd.expovariate(1 / distance))
+        records.append(Record(bicycle=bicycle, date=day, km=km))
+        day += timedelta(days=1)
+
+    Record.objects.bulk_create(records)
+
+
+# Materials of the part, each mounted until it has run about the part's wear limit
+def _materials(part, bicycle, records, rnd):
+    materials = []
+    limit = part.wear_limit or 20000
+    index = 0
+
+    while index < len(records):
+        material = _material(part, rnd)
+        # bulk_create doesn't call Material.save()
+        material.mount_record_id = records[index][0]
+        material.state, material.bicycle = Material.MOUNTED, bicycle
+
+        worn = records[index][1] + int(limit * rnd.uniform(0.7, 1.2))
+        while index < len(records) and records[index][1] < worn:
+            index += 1
+        if index < len(records):
+            material.dismount_record_id = records[index][0]
+            material.state, material.bicycle = Material.DISMOUNTED, None
+
+        materials.append(material)
+
+    return materials
+
+
+def _material(part, rnd):
+    return Material(
+        name="{} {}".format(part.name, rnd.randint(100, 999)),
+        manufactor=rnd.choice(MANUFACTORS),
+        size=rnd.choice([None, "28-622", "11-speed", "M"]),
+        price=round(rnd.uniform(5, 120), 2),
+        part=part)
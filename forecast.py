@@ -0,0 +1,121 @@
+from datetime import date, timedelta
+
+from django.db.models.functions import Coalesce
+
+from myequis.models import Material
+from myequis.models import Record
+
+# Optional, the forecast is not available without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Days before a bicycle's last record its records are fitted over
+FIT_DAYS = 180
+
+# Ordinal of the day numpy's datetime64 counts from
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+# Forecast of a mounted material reaching its wear limit
+class Wear:
+
+    def __init__(self, material, limit, mileage, km_per_day, due):
+        self.material = material
+        self.limit = limit
+        self.mileage = mileage
+        # Current speed of the bicycle
+        self.km_per_day = km_per_day
+        # Date the limit is reached, None if the bicycle doesn't move
+        self.due = due
+
+    def worn(self):
+        return self.limit is not None and self.mileage is not None and self.mileage >= self.limit
+
+
+def available():
+    return numpy is not None
+
+
+# Forecasts for all mounted materials with a wear limit (the material's or its part's).
+#
+# The km over time of each bicycle is fitted linearly over the records of its last
+# FIT_DAYS days. The records are loaded by one range from the earliest window start on,
+# the records before a bicycle's own window are masked out in the arrays. All bicycles are
+# fitted at once: the sums of the least squares fit are accumulated per bicycle with bincount.
+# Two queries, no Python loop over records. Returns the forecasts ordered by due date.
+def forecast(materials=None):
+    if numpy is None:
+        raise RuntimeError("The wear forecast requires NumPy")
+
+    if materials is None:
+        materials = Material.objects.all()
+
+    materials = list(materials.filter(state=Material.MOUNTED)
+                     .annotate(limit=Coalesce('wear_limit', 'part__wear_limit'))
+                     .filter(limit__isnull=False)
+                     .with_related().with_mileage()
+                     .annotate(last_date=Coalesce('bicycle__summary__last_date',
+                                                  'mount_record__date')))
+    if not materials:
+        return []
+
+    # Bicycles as indexes 0..n-1
+    bicycle_ids = sorted({material.bicycle_id for material in materials})
+    index = {bicycle_id: i for i, bicycle_id in enumerate(bicycle_ids)}
+    last_days = numpy.zeros(len(bicycle_ids))
+    for material in materials:
+        last_days[index[material.bicycle_id]] = material.last_date.toordinal()
+
+    start = date.fromordinal(int(last_days.min()) - FIT_DAYS)
+    rows = (Record.objects.select_related(None)
+            .filter(bicycle_id__in=bicycle_ids, date__gte=start)
+            .values_list('bicycle_id', 'date', 'km'))
+    slope, intercept = _fit(list(rows), numpy.array(bicycle_ids), last_days)
+
+    # Day (relative to the bicycle's last record) the odometer reaches mount km + limit
+    bicycles = numpy.array([index[material.bicycle_id] for material in materials])
+    targets = numpy.array([float(material.mount_record.km) + material.limit for material in materials])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        days = (targets - intercept[bicycles]) / slope[bicycles]
+    moving = numpy.isfinite(days) & (slope[bicycles] > 0)
+
+    wears = []
+    for i, material in enumerate(materials):
+        due = None
+        if moving[i]:
+            due = date.fromordinal(int(last_days[bicycles[i]])) + timedelta(days=int(numpy.ceil(days[i])))
+        wears.append(Wear(material, material.limit, material.mileage, slope[bicycles[i]], due))
+
+    wears.sort(key=lambda wear: (wear.due is None, wear.due))
+    return wears
+
+
+# Least squares fit km = intercept + slope * day per bicycle, day relative to the
+# bicycle's last record, over the last FIT_DAYS days. rows are (bicycle id, date, km),
+# bicycle_ids sorted. Bicycles with less than two records get slope nan.
+def _fit(rows, bicycle_ids, last_days):
+    # columns, converted by numpy
+    bicycles, days, kms = zip(*rows) if rows else ((), (), ())
+    bicycles = numpy.searchsorted(bicycle_ids, numpy.array(bicycles, dtype=numpy.int64))
+    x = numpy.array(days, dtype='datetime64[D]').astype(float) - (last_days - EPOCH)[bicycles]
+    y = numpy.array(kms, dtype=float)
+
+    # rows before the bicycle's own window
+    window = x >= -FIT_DAYS
+    bicycles, x, y = bicycles[window], x[window], y[window]
+
+    size = len(last_days)
+    n = numpy.bincount(bicycles, minlength=size)
+    sx = numpy.bincount(bicycles, x, minlength=size)
+    sy = numpy.bincount(bicycles, y, minlength=size)
+    sxx = numpy.bincount(bicycles, x * x, minlength=size)
+    sxy = numpy.bincount(bicycles, x * y, minlength=size)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        intercept = (sy - slope * sx) / n
+
+    return slope, intercept
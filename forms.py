@@ -1,4 +1,6 @@
 from django import forms
+from myequis.models import Material
+from myequis.models import Part
 from myequis.models import Record
 from datetime import datetime, timedelta
 from django.utils.translation import ugettext as _
@@ -7,66 +9,113 @@ import logging
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# Check a record's date and km against its direct neighbours of the same bicycle.
+# previous is the nearest record at or before date, following the nearest one after it.
+# Both may be None. Any object with date and km attributes will do.
+def check_record_neighbours(date, km, previous, following):
+    if previous is not None and previous.date == date:
+        raise forms.ValidationError(
+            _("Record for date %(date)s already exists"), 
+            code="record_date_dublicate",
+            params={'date': date}, 
+            )
+    
+    if previous is not None and km < previous.km:
+        raise forms.ValidationError(
+            _("%(km)d < %(r_km)d km of record for date %(r_date)s"), 
+            code="record_date_dublicate",
+            params={'km': km, 'r_km': previous.km, 'r_date': previous.date}, 
+            )
+    
+    if following is not None and km > following.km:
+        raise forms.ValidationError(
+            _("%(km)d > %(r_km)d km of record for date %(r_date)s"), 
+            code="record_date_dublicate",
+            params={'km': km, 'r_km': following.km, 'r_date': following.date}, 
+            )
+
+
 # Edit Record
 class RecordForm(forms.Form):
     custom_validations = False
+    bicycle_id = None
+    record_id = None
     date = forms.DateField(label='Date')   
     km = forms.IntegerField(label='KM', min_value=0)
-    id = forms.IntegerField(label='id', widget=forms.HiddenInput())
+    # Empty for a new record
+    id = forms.IntegerField(label='id', widget=forms.HiddenInput(), required=False)
     
     # must be called to enable custom validations with POST
-    def enable_validations(self):
+    # The bicycle the record belongs to must be given, for an edited record also its id.
+    # The posted id is not used, it can't be trusted.
+    def enable_validations(self, bicycle_id, record_id=None):
         self.custom_validations = True
+        self.bicycle_id = bicycle_id
+        self.record_id = record_id
     
     def clean(self):
         clean_data = super().clean()
 
-        if self.custom_validations:
+        if self.custom_validations and not self.errors:
             self.check_edit_record()
         
+        return clean_data
+        
 
 #   Check if the give record values against the existing ones        
+#   Only the nearest earlier and the nearest later record of the bicycle are loaded,
+#   both by the (bicycle, date) index, so the costs don't depend on the history's length.
     def check_edit_record(self):
-        #logger.warning("LOGGER: " + str(self.cleaned_data))
         
         #get the actual form data we have to check
-        id = self.cleaned_data['id']
         date = self.cleaned_data['date']
         km = self.cleaned_data['km']
 
-        # Persisted Record under edit
-        record = Record.objects.get(pk=id)
-
-        
-        #raise forms.ValidationError("check_edit_record")
-        
         # bicycle's others
-        records = Record.objects.filter(bicycle_id=record.bicycle.id).exclude(id=id)
+        records = Record.objects.filter(bicycle_id=self.bicycle_id)
+        if self.record_id is not None:
+            # Persisted Record under edit
+            records = records.exclude(id=self.record_id)
+        
+        previous = records.filter(date__lte=date).order_by('-date').first()
+        following = records.filter(date__gt=date).order_by('date').first()
         
-        for r in records:
-            logger.warning("LOGGER: " + str(r))
-            delta = date - r.date
-            
-            if delta.days == 0:
-                raise forms.ValidationError(
-                    _("Record for date %(date)s already exists"), 
-                    code="record_date_dublicate",
-                    params={'date': date}, 
-                    )
-            
-            if delta.days > 0 and km < r.km:
-                raise forms.ValidationError(
-                    _("%(km)d < %(r_km)d km of record for date %(r_date)s"), 
-                    code="record_date_dublicate",
-                    params={'km': km, 'r_km': r.km, 'r_date': r.date}, 
-                    )
-            
-            if delta.days < 0 and km > r.km:
-                raise forms.ValidationError(
-                    _("%(km)d > %(r_km)d km of record for date %(r_date)s"), 
-                    code="record_date_dublicate",
-                    params={'km': km, 'r_km': r.km, 'r_date': r.date}, 
-                    )
-            
+        check_record_neighbours(date, km, previous, following)
+
+
+# Swap materials of a bicycle at one record
+class SwapForm(forms.Form):
+    date = forms.DateField(label='Date')
+    km = forms.IntegerField(label='KM', min_value=0)
+    mount = forms.ModelMultipleChoiceField(
+        label='Mount', required=False, widget=forms.CheckboxSelectMultiple,
+        queryset=Material.objects.filter(state=Material.NEW, part__isnull=False).with_related().order_by('part', 'name'))
+    dismount = forms.ModelMultipleChoiceField(
+        label='Dismount only', required=False, widget=forms.CheckboxSelectMultiple,
+        queryset=Part.objects.order_by('component__name', 'name'))
     
+    def clean(self):
+        clean_data = super().clean()
+        
+        if not self.errors and not clean_data['mount'] and not clean_data['dismount']:
+            raise forms.ValidationError(_("Nothing to mount or dismount"), code="swap_empty")
+        
+        return clean_data
+
+
+class ConfigurationForm(forms.Form):
+    date = forms.DateField(label='Date')
+    until = forms.DateField(label='Until', required=False)
+    compare = forms.DateField(label='Compare with', required=False)
     
+    def clean(self):
+        clean_data = super().clean()
+        
+        if not self.errors and clean_data['until'] is not None and clean_data['until'] < clean_data['date']:
+            raise forms.ValidationError(_("Until must not be before the date"), code="until_before_date")
+        
+        return clean_data
+
+
+class GpxForm(forms.Form):
+    files = forms.FileField(label='GPX files', widget=forms.ClearableFileInput(attrs={'multiple': True}))
@@ -0,0 +1,154 @@
+from array import array
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from myequis.models import Bicycle
+from myequis.models import Record
+from myequis.signals import bicycles_changed
+
+# Optional, GPX files can't be imported without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Rides of GPX files as records: every track is a ride, dated by its first point's time.
+#
+# The files are parsed as a stream, the points are dropped from the XML tree as soon as they
+# are read. Their coordinates are collected in two arrays of doubles, up to CHUNK points of a
+# track segment are measured at once with a vectorized haversine, so the memory doesn't
+# depend on the size of a file.
+
+# Mean earth radius
+EARTH_RADIUS_KM = 6371.0088
+
+# Points measured at once
+CHUNK = 65536
+
+
+def available():
+    return numpy is not None
+
+
+class Ride:
+
+    def __init__(self, date, km):
+        # Local date of the first point, None without times
+        self.date = date
+        self.km = km
+
+
+def _tag(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _date(text):
+    time = parse_datetime(text.strip()) if text else None
+    if time is None:
+        return None
+    if settings.USE_TZ and timezone.is_aware(time):
+        time = timezone.localtime(time)
+    return time.date()
+
+
+# Length in km of the path through the points
+def haversine(lats, lons):
+    if len(lats) < 2:
+        return 0.0
+
+    lats = numpy.radians(numpy.frombuffer(lats, dtype=numpy.float64))
+    lons = numpy.radians(numpy.frombuffer(lons, dtype=numpy.float64))
+    dlat = numpy.diff(lats)
+    dlon = numpy.diff(lons)
+    a = numpy.sin(dlat / 2) ** 2 + numpy.cos(lats[:-1]) * numpy.cos(lats[1:]) * numpy.sin(dlon / 2) ** 2
+    return float(2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0))).sum())
+
+
+# Rides of the tracks in a GPX file (path or file object).
+# Raises ParseError for files that aren't well-formed XML, ValueError for invalid points.
+def read(file):
+    rides = []
+    segment = None
+    lats = array('d')
+    lons = array('d')
+    km = 0.0
+    date = None
+
+    for event, element in iterparse(file, events=('start', 'end')):
+        tag = _tag(element)
+
+        if event == 'start':
+            if tag == 'trk':
+                km, date = 0.0, None
+            elif tag == 'trkseg':
+                segment = element
+            continue
+
+        if tag == 'trkpt':
+            if element.get('lat') is None or element.get('lon') is None:
+                raise ValueError("Track point without lat or lon")
+            lats.append(float(element.get('lat')))
+            lons.append(float(element.get('lon')))
+            if date is None:
+                for child in element:
+                    if _tag(child) == 'time':
+                        date = _date(child.text)
+            # the segment keeps its points otherwise
+            if segment is not None:
+                segment.remove(element)
+            if len(lats) >= CHUNK:
+                km += haversine(lats, lons)
+                # the next chunk starts at the last point
+                lats, lons = lats[-1:], lons[-1:]
+        elif tag == 'trkseg':
+            km += haversine(lats, lons)
+            lats, lons = array('d'), array('d')
+            segment = None
+            element.clear()
+        elif tag == 'trk':
+            rides.append(Ride(date, km))
+            element.clear()
+
+    return rides
+
+
+# For a process pool: path, the rides as (date, km) and the error, if any
+def read_path(path):
+    try:
+        return path, [(ride.date, ride.km) for ride in read(path)], None
+    except (OSError, ParseError, ValueError) as e:
+        return path, [], str(e)
+
+
+# Appends a record per day of the rides, with the bicycle's km plus the rides' distances.
+# Rides without date or not after the bicycle's last record are skipped, so importing a file
+# twice doesn't count its rides twice. rides are (date, km). Returns the new records.
+def append(bicycle_id, rides):
+    with transaction.atomic():
+        # concurrent imports of the bicycle one after another
+        list(Bicycle.objects.select_for_update().filter(pk=bicycle_id).values_list('id'))
+        last = Record.objects.select_related(None).filter(bicycle_id=bicycle_id).order_by('-date').first()
+
+        days = {}
+        for date, km in rides:
+            if date is not None and (last is None or date > last.date):
+                days[date] = days.get(date, 0.0) + km
+
+        total = float(last.km) if last is not None else 0.0
+        records = []
+        for date in sorted(days):
+            total += days[date]
+            records.append(Record(bicycle_id=bicycle_id, date=date, km=round(total)))
+
+        Record.objects.bulk_create(records)
+
+        # bulk_create doesn't send signals
+        if records:
+            bicycles_changed([bicycle_id])
+
+    return records
@@ -0,0 +1,189 @@
+from bisect import bisect_left, bisect_right
+import hmac
+
+from django import forms
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.translation import ugettext as _
+
+from myequis.forms import check_record_neighbours
+from myequis.models import Bicycle
+from myequis.models import Record
+from myequis.signals import bicycles_changed, in_history
+
+
+# Ingestion of odometer readings, e.g. posted by bike computers many times a day.
+#
+# The readings are coalesced to one record per bicycle and day with the day's greatest km.
+# A day's record is created or its km increased (upsert). Each reading is checked against
+# the neighbouring records like RecordForm does, in bulk: the records of a bicycle within
+# the readings' days and their two neighbours are loaded at once, not per reading.
+#
+# The bicycles are locked while their records are written, so concurrent posts of the same
+# bicycle are serialized. On databases without row locks, a post that loses the race for a
+# new day hits the unique (bicycle, date) constraint and is retried.
+#
+# Settings:
+#   MYEQUIS_INGEST_TOKENS  tokens accepted in the Authorization: Token <token> header,
+#                          ingestion is disabled without
+
+# Readings per request
+MAX_READINGS = 10000
+
+RETRIES = 3
+
+
+# Whether token is one of MYEQUIS_INGEST_TOKENS
+def authorized(token):
+    return any(hmac.compare_digest(token, accepted) for accepted in getattr(settings, 'MYEQUIS_INGEST_TOKENS', []))
+
+
+# A reading's day, of a date or the local date of a time
+def reading_date(value):
+    if not isinstance(value, str):
+        return None
+
+    time = parse_datetime(value)
+    if time is None:
+        return parse_date(value)
+    if settings.USE_TZ and timezone.is_aware(time):
+        time = timezone.localtime(time)
+    return time.date()
+
+
+class Reading:
+    __slots__ = ('index', 'bicycle', 'date', 'km')
+
+    def __init__(self, index, bicycle, date, km):
+        self.index = index
+        self.bicycle = bicycle
+        self.date = date
+        self.km = km
+
+
+# Readings of a request as a list of dicts with bicycle, date (date or time) and km.
+# Returns the valid readings and the errors of the others as (index, message).
+def parse(readings):
+    valid = []
+    errors = []
+
+    for index, reading in enumerate(readings):
+        try:
+            bicycle = int(reading['bicycle'])
+            day = reading_date(reading['date'])
+            km = int(reading['km'])
+        except KeyError:
+            errors.append((index, _("bicycle, date and km are required")))
+            continue
+        except (TypeError, ValueError):
+            day = None
+
+        if day is None or km < 0:
+            errors.append((index, _("Invalid bicycle, date or km")))
+            continue
+
+        valid.append(Reading(index, bicycle, day, km))
+
+    return valid, errors
+
+
+# Stores the readings. Returns the numbers of created and updated records and the errors.
+# Readings coalesced into a reading with more km of the same day are neither stored nor reported.
+def ingest(readings):
+    for attempt in range(RETRIES):
+        try:
+            with transaction.atomic():
+                return _ingest(readings)
+        except IntegrityError:
+            if attempt == RETRIES - 1:
+                raise
+
+
+def _ingest(readings):
+    errors = []
+
+    # the greatest km of each bicycle and day
+    days = {}
+    for reading in readings:
+        key = (reading.bicycle, reading.date)
+        if key not in days or reading.km > days[key].km:
+            days[key] = reading
+
+    bicycles = {}
+    for reading in days.values():
+        bicycles.setdefault(reading.bicycle, []).append(reading)
+
+    # in the order of the ids, so concurrent posts don't deadlock
+    existing = set(Bicycle.objects.select_for_update().filter(id__in=bicycles).order_by('id').values_list('id', flat=True))
+
+    created = []
+    updated = []
+    for bicycle_id, readings in sorted(bicycles.items()):
+        if bicycle_id not in existing:
+            errors.extend((reading.index, _("Unknown bicycle")) for reading in readings)
+            continue
+
+        readings.sort(key=lambda reading: reading.date)
+        new, changed, rejected = _merge(bicycle_id, readings)
+        created.extend(new)
+        updated.extend(changed)
+        errors.extend(rejected)
+
+    now = timezone.now()
+    for record in created + updated:
+        record.modified = now
+    Record.objects.bulk_create(created)
+    Record.objects.bulk_update(updated, ['km', 'modified'])
+
+    # bulk_create and bulk_update don't send signals
+    changed_days = [record.date for record in created + updated]
+    if changed_days:
+        bicycles_changed({record.bicycle_id for record in created + updated}, history=in_history(changed_days))
+
+    return len(created), len(updated), sorted(errors)
+
+
+# New and changed records of the bicycle for its readings sorted by date, and their errors
+def _merge(bicycle_id, readings):
+    first, last = readings[0].date, readings[-1].date
+    records = Record.objects.select_related(None).filter(bicycle_id=bicycle_id)
+
+    # the days of the readings and their neighbours
+    loaded = list(records.filter(date__gte=first, date__lte=last))
+    previous = records.filter(date__lt=first).order_by('-date').first()
+    following = records.filter(date__gt=last).order_by('date').first()
+    series = sorted([record for record in (previous, following) if record is not None] + loaded,
+                    key=lambda record: record.date)
+    dates = [record.date for record in series]
+
+    new = []
+    changed = []
+    errors = []
+    for reading in readings:
+        position = bisect_left(dates, reading.date)
+        record = series[position] if position < len(series) and dates[position] == reading.date else None
+
+        if record is not None and reading.km <= record.km:
+            continue
+
+        following = bisect_right(dates, reading.date)
+        try:
+            check_record_neighbours(
+                reading.date, reading.km, series[position - 1] if position > 0 else None,
+                series[following] if following < len(series) else None)
+        except forms.ValidationError as e:
+            errors.append((reading.index, e.messages[0]))
+            continue
+
+        if record is None:
+            record = Record(bicycle_id=bicycle_id, date=reading.date, km=reading.km)
+            series.insert(position, record)
+            dates.insert(position, reading.date)
+            new.append(record)
+        else:
+            record.km = reading.km
+            changed.append(record)
+
+    return new, changed, errors
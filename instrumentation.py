@@ -0,0 +1,132 @@
+from collections import deque
+from functools import wraps
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.backends.django import Template
+
+
+# Opt-in measurement of the myequis views. Enable it with
+#
+#   MYEQUIS_INSTRUMENTATION = True
+#   MIDDLEWARE = [..., 'myequis.instrumentation.InstrumentationMiddleware']
+#
+# For each request, it measures the number of SQL queries, the time spent in the database,
+# the time spent rendering templates and the wall time. They are sent in the headers
+# X-Query-Count and Server-Timing. The last MYEQUIS_INSTRUMENTATION_WINDOW (default 1000)
+# measurements per URL name are kept in this process for the percentiles on the
+# instrumentation page. The rendering of templates is wrapped once at startup, see install().
+
+# Measurements of the request handled by the current thread
+_local = threading.local()
+
+_lock = threading.Lock()
+_measurements = {}
+
+
+class Measurement:
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.wall = 0.0
+
+
+# Wraps the rendering of Django templates to measure it
+def _measure_render(render):
+    @wraps(render)
+    def measured(self, *args, **kwargs):
+        measurement = getattr(_local, 'measurement', None)
+        if measurement is None:
+            return render(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            measurement.render += time.perf_counter() - start
+
+    measured.measured = True
+    return measured
+
+
+# Wraps the rendering of Django templates, only once per process. Called by
+# MyequisConfig.ready() with MYEQUIS_INSTRUMENTATION.
+def install():
+    with _lock:
+        if not getattr(Template.render, 'measured', False):
+            Template.render = _measure_render(Template.render)
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MYEQUIS_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        self.window = getattr(settings, 'MYEQUIS_INSTRUMENTATION_WINDOW', 1000)
+
+    def __call__(self, request):
+        measurement = _local.measurement = Measurement()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self.measure_query):
+                response = self.get_response(request)
+        finally:
+            _local.measurement = None
+        measurement.wall = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is None or match.namespace != 'myequis':
+            return response
+
+        response['X-Query-Count'] = str(measurement.queries)
+        response['Server-Timing'] = 'db;dur={:.1f}, render;dur={:.1f}, total;dur={:.1f}'.format(
+            measurement.db * 1000, measurement.render * 1000, measurement.wall * 1000)
+
+        with _lock:
+            if match.url_name not in _measurements:
+                _measurements[match.url_name] = deque(maxlen=self.window)
+            _measurements[match.url_name].append(measurement)
+
+        return response
+
+    def measure_query(self, execute, sql, params, many, context):
+        measurement = _local.measurement
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            measurement.queries += 1
+            measurement.db += time.perf_counter() - start
+
+
+# Nearest rank percentile of sorted values
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# Percentiles (p50, p95, p99) of each measured value per URL name, times in ms
+def report():
+    with _lock:
+        measurements = {name: list(values) for name, values in _measurements.items()}
+
+    rows = []
+    for name in sorted(measurements):
+        row = {'name': name, 'count': len(measurements[name])}
+        for value, factor in (('wall', 1000), ('render', 1000), ('db', 1000), ('queries', 1)):
+            values = sorted(getattr(measurement, value) * factor for measurement in measurements[name])
+            row[value] = [_percentile(values, percent) for percent in (50, 95, 99)]
+        rows.append(row)
+
+    return rows
+
+
+def reset():
+    with _lock:
+        _measurements.clear()
@@ -0,0 +1,168 @@
+from datetime import date, datetime
+import json
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from myequis import caching
+from myequis import fleet
+from myequis import summary
+from myequis import views
+from myequis.forms import RecordForm
+from myequis.models import Bicycle
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Record
+from myequis.pagination import PAGE_SIZE, format_cursor
+
+
+# Raised to roll back the benchmark data
+class _Rollback(Exception):
+    pass
+
+
+# Times the views, the record validation and the admin pages on generated fleets
+# (see fleet.py) of several sizes. Each size is generated in a transaction which
+# is rolled back afterwards. The caches are dropped before every run, so the
+# times are those of a cold cache.
+#
+# The results are written as JSON. With --compare, they are checked against the
+# results of a previous run, cases slower than --threshold times are reported.
+class Command(BaseCommand):
+    help = "Benchmark views, record validation and admin pages on generated fleets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='0.25,1,4',
+                            help="Comma separated years of daily records per bicycle")
+        parser.add_argument('--bicycles', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per case")
+        parser.add_argument('--output', help="JSON file, default benchmark-<time>.json")
+        parser.add_argument('--compare', help="JSON file of a previous run")
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help="Ratio to the previous time that counts as regression")
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        self.factory = RequestFactory()
+        self.user = User(username='benchmark', is_staff=True, is_superuser=True, is_active=True)
+
+        results = {
+            'created': datetime.now().isoformat(),
+            'bicycles': options['bicycles'],
+            'repeat': self.repeat,
+            'sizes': {},
+        }
+
+        for size in options['sizes'].split(','):
+            try:
+                with transaction.atomic():
+                    results['sizes'][size] = self.run_size(options['bicycles'], float(size))
+                    raise _Rollback()
+            except _Rollback:
+                pass
+            finally:
+                caching.invalidate_now('all')
+
+        output = options['output'] or "benchmark-{:%Y%m%d-%H%M%S}.json".format(datetime.now())
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write("Results written to {}".format(output))
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.compare(json.load(file), results, options['threshold'])
+
+    def run_size(self, bicycles, years):
+        bicycle = fleet.generate(bicycles=bicycles, years=years, seed=0, end=date(2020, 1, 1))[0]
+        # the summaries are refreshed on commit otherwise
+        summary.rebuild()
+
+        records = Record.objects.filter(bicycle=bicycle)
+        record = records.order_by('date')[records.count() // 2]
+        # the last page: the oldest PAGE_SIZE records follow this one
+        deep = records.order_by('date', 'id')[min(PAGE_SIZE, records.count() - 1)]
+        material = Material.objects.filter(mount_record__bicycle=bicycle).first()
+
+        result = {
+            'records': Record.objects.count(),
+            'materials': Material.objects.count(),
+            'cases': {},
+        }
+        self.stdout.write("{} years, {records} records, {materials} materials".format(years, **result))
+
+        get = self.factory.get
+        cases = [
+            ('view:index', lambda: views.index(get('/'))),
+            ('view:bicycle', lambda: views.bicycle(get('/'), bicycle_id=bicycle.id)),
+            ('view:records', lambda: views.records(get('/'), bicycle_id=bicycle.id)),
+            ('view:records_deep', lambda: views.records(
+                get('/', {'after': format_cursor(deep)}), bicycle_id=bicycle.id)),
+            ('view:record', lambda: views.UpdateRecordView.as_view()(get('/'), record_id=record.id)),
+            ('view:create_record', lambda: views.create_record(get('/'), bicycle_id=bicycle.id)),
+            ('view:newmaterials', lambda: views.newmaterials(get('/'))),
+            ('view:forecast', lambda: views.wear_forecast(get('/'))),
+            ('view:export_records', lambda: b''.join(
+                views.export_records(get('/'), bicycle_id=bicycle.id).streaming_content)),
+            ('form:record', lambda: self.validate(record)),
+            ('admin:bicycle_changelist', lambda: self.admin(Bicycle, 'changelist_view')),
+            ('admin:bicycle_change', lambda: self.admin(Bicycle, 'change_view', str(bicycle.id))),
+            ('admin:component_changelist', lambda: self.admin(Component, 'changelist_view')),
+            ('admin:material_changelist', lambda: self.admin(Material, 'changelist_view')),
+            ('admin:material_change', lambda: self.admin(Material, 'change_view', str(material.id))),
+        ]
+
+        for name, case in cases:
+            result['cases'][name] = timing = self.measure(case)
+            self.stdout.write("  {:<28} {mean_ms:9.2f} ms {queries:5} queries".format(name, **timing))
+
+        return result
+
+    def validate(self, record):
+        form = RecordForm({'id': record.id, 'date': record.date, 'km': record.km})
+        form.enable_validations(record.bicycle_id, record_id=record.id)
+        if not form.is_valid():
+            raise CommandError(form.errors)
+
+    def admin(self, model, view, *args):
+        request = self.factory.get('/')
+        request.user = self.user
+        response = getattr(admin.site._registry[model], view)(request, *args)
+        return response.render()
+
+    def measure(self, case):
+        times = []
+        for i in range(self.repeat):
+            caching.invalidate_now('all')
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                case()
+                times.append(time.perf_counter() - start)
+
+        return {
+            'mean_ms': sum(times) / len(times) * 1000,
+            'min_ms': min(times) * 1000,
+            'queries': len(queries),
+        }
+
+    def compare(self, previous, current, threshold):
+        regressions = 0
+        for size, result in current['sizes'].items():
+            for name, timing in result['cases'].items():
+                before = previous.get('sizes', {}).get(size, {}).get('cases', {}).get(name)
+                if before is None:
+                    continue
+
+                ratio = timing['min_ms'] / before['min_ms'] if before['min_ms'] else 1
+                if ratio > threshold or timing['queries'] > before['queries']:
+                    regressions += 1
+                    self.stderr.write("{} years {}: {:.2f} ms -> {:.2f} ms, {} -> {} queries".format(
+                        size, name, before['min_ms'], timing['min_ms'], before['queries'], timing['queries']))
+
+        if regressions:
+            raise CommandError("{} regressions".format(regressions))
+        self.stdout.write("No regressions")
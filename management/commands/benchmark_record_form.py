@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myequis.forms import RecordForm
+from myequis.models import Bicycle
+from myequis.models import Record
+
+
+# Raised to roll back the benchmark data
+class _Rollback(Exception):
+    pass
+
+
+# Measures the save latency of records like the record views do: RecordForm validation and
+# Record.save(), alternately of an edited record in the middle of the history and of a new
+# record appended to it, for bicycles with growing record histories.
+# All data is created in a transaction which is rolled back at the end.
+class Command(BaseCommand):
+    help = "Benchmark the record validation and save for several history sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000',
+                            help="Comma separated numbers of records per bicycle")
+        parser.add_argument('--repeat', type=int, default=200,
+                            help="Saves per size")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        for size in sizes:
+            try:
+                with transaction.atomic():
+                    seconds = self.measure(size, options['repeat'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+            self.stdout.write("{:>8} records: {:8.3f} ms per save".format(size, seconds * 1000))
+
+    def measure(self, size, repeat):
+        bicycle = Bicycle.objects.create(name="benchmark")
+        start = date(2000, 1, 1)
+        Record.objects.bulk_create(
+            [Record(bicycle=bicycle, date=start + timedelta(days=i), km=i * 10) for i in range(size)])
+
+        middle = Record.objects.filter(bicycle=bicycle).order_by('date')[size // 2]
+
+        begin = time.perf_counter()
+        for i in range(repeat):
+            if i % 2 == 0:
+                # edit a record in the middle of the history
+                record = middle
+                form = RecordForm({'id': middle.id, 'date': middle.date, 'km': middle.km})
+                form.enable_validations(bicycle.id, record_id=middle.id)
+            else:
+                # append a new record
+                record = Record(bicycle=bicycle)
+                form = RecordForm({'id': '', 'date': start + timedelta(days=size + i), 'km': (size + i) * 10})
+                form.enable_validations(bicycle.id)
+
+            if not form.is_valid():
+                raise AssertionError(form.errors)
+            record.date = form.cleaned_data['date']
+            record.km = form.cleaned_data['km']
+            record.save()
+
+        return (time.perf_counter() - begin) / repeat
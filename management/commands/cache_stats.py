@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myequis import caching
+
+
+class Command(BaseCommand):
+    help = "Show the hit and miss counters of the myequis cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters afterwards")
+
+    def handle(self, *args, **options):
+        stats = caching.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+
+        self.stdout.write("hits: {hits}, misses: {misses}".format(**stats) + ", hit ratio: {:.1%}".format(ratio))
+
+        if options['reset']:
+            caching.reset_stats()
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myequis import compaction
+
+
+# Thins out the old records of the bicycles, see compaction.py
+class Command(BaseCommand):
+    help = "Compact old records to weekly and monthly ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bicycle', type=int, action='append', dest='bicycles',
+                            help="Id of a bicycle to compact, default: all")
+        parser.add_argument('--weekly-after', type=int, default=compaction.WEEKLY_AFTER,
+                            help="Days after which one record per week is kept")
+        parser.add_argument('--monthly-after', type=int, default=compaction.MONTHLY_AFTER,
+                            help="Days after which one record per month is kept")
+        parser.add_argument('--batch-size', type=int, default=compaction.BATCH_SIZE,
+                            help="Records deleted per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Count only, don't delete anything")
+
+    def handle(self, *args, **options):
+        if options['monthly_after'] < options['weekly_after']:
+            raise CommandError("--monthly-after must not be less than --weekly-after")
+
+        deleted = compaction.compact(
+            options['bicycles'], options['weekly_after'], options['monthly_after'],
+            batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        for bicycle_id, count in deleted.items():
+            self.stdout.write("bicycle {}: {} records {}".format(
+                bicycle_id, count, "obsolete" if options['dry_run'] else "deleted"))
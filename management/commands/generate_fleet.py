@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myequis import fleet
+
+
+class Command(BaseCommand):
+    help = "Generate bicycles with daily records, parts and materials for development and benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bicycles', type=int, default=3)
+        parser.add_argument('--years', type=float, default=1, help="Years of daily records")
+        parser.add_argument('--stock', type=int, default=20, help="Unused materials")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        bicycles = fleet.generate(
+            bicycles=options['bicycles'], years=options['years'], seed=options['seed'], stock=options['stock'])
+
+        for bicycle in bicycles:
+            self.stdout.write("Created {} (id {})".format(bicycle.name, bicycle.id))
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from myequis import gpx
+from myequis.models import Bicycle
+
+
+# Imports the rides of GPX files as records of a bicycle, see gpx.py.
+#
+# Directories are searched for *.gpx files. The files are parsed by a pool of processes,
+# each file is read as a stream, so memory doesn't depend on the file sizes.
+# Only the dates and distances of the rides are sent back and written in one transaction.
+class Command(BaseCommand):
+    help = "Import the rides of GPX files as records of a bicycle"
+
+    def add_arguments(self, parser):
+        parser.add_argument('bicycle', help="Id or name of the bicycle")
+        parser.add_argument('paths', nargs='+', help="GPX files or directories containing them")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Processes parsing the files, default: number of CPUs")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Parse only, don't write anything")
+
+    def handle(self, *args, **options):
+        if not gpx.available():
+            raise CommandError("Importing GPX files requires NumPy")
+
+        bicycle = self.bicycle(options['bicycle'])
+        files = list(self.files(options['paths']))
+
+        rides = []
+        errors = 0
+        # the workers must neither share the connections nor depend on fork
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for path, file_rides, error in pool.map(gpx.read_path, files, chunksize=8):
+                if error is not None:
+                    errors += 1
+                    self.stderr.write("{}: {}".format(path, error))
+                rides.extend(file_rides)
+
+        km = sum(km for date, km in rides)
+        self.stdout.write("{} files, {} rides, {:.1f} km, {} invalid files".format(len(files), len(rides), km, errors))
+
+        if not options['dry_run']:
+            records = gpx.append(bicycle.id, rides)
+            self.stdout.write("{} records added to {}".format(len(records), bicycle.name))
+
+    def bicycle(self, value):
+        bicycles = Bicycle.objects.filter(pk=value) if value.isdigit() else Bicycle.objects.filter(name=value)
+        bicycle = bicycles.first()
+        if bicycle is None:
+            raise CommandError("Unknown bicycle {}".format(value))
+        return bicycle
+
+    def files(self, paths):
+        for path in paths:
+            if os.path.isdir(path):
+                for directory, directories, names in os.walk(path):
+                    directories.sort()
+                    for name in sorted(names):
+                        if name.lower().endswith('.gpx'):
+                            yield os.path.join(directory, name)
+            else:
+                yield path
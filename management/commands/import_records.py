@@ -0,0 +1,193 @@
+import csv
+import datetime
+import json
+
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from myequis.forms import check_record_neighbours
+from myequis.models import Bicycle
+from myequis.models import Record
+from myequis.signals import bicycles_changed
+from myequis.sync import restamp_on_commit
+
+
+# Raised to roll back a dry run
+class _Rollback(Exception):
+    pass
+
+
+# Row of the import file
+class _Row:
+    __slots__ = ('line', 'bicycle', 'date', 'km')
+
+    def __init__(self, line, bicycle, date, km):
+        self.line = line
+        self.bicycle = bicycle
+        self.date = date
+        self.km = km
+
+
+# Imports records from a CSV or NDJSON file with the fields bicycle, date and km.
+# bicycle is the id or the name of the bicycle, date is YYYY-MM-DD.
+#
+# The file must be sorted by bicycle and date. It is read as a stream in one pass,
+# the existing records of each bicycle are merged in by date, so every row is checked
+# against its neighbours like RecordForm does. Memory doesn't depend on the file size.
+class Command(BaseCommand):
+    help = "Import records from a CSV or NDJSON file sorted by bicycle and date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="CSV file with header bicycle,date,km or NDJSON file")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="Default: derived from the file extension")
+        parser.add_argument('--batch-size', type=int, default=300,
+                            help="Records per bulk insert")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate only, don't write anything")
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help="Import the valid rows even if some rows are invalid")
+
+    def handle(self, *args, **options):
+        format = options['format']
+        if format is None:
+            format = 'ndjson' if options['file'].endswith(('.ndjson', '.jsonl')) else 'csv'
+
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.errors = 0
+        self.imported = 0
+        self.bicycles = {}
+        # bicycles with imported records
+        self.written = set()
+        started = timezone.now()
+
+        try:
+            with open(options['file'], newline='') as file:
+                with transaction.atomic():
+                    rows = self.read_csv(file) if format == 'csv' else self.read_ndjson(file)
+                    self.import_rows(rows)
+
+                    # a large file takes longer than the delta sync waits for a transaction
+                    restamp_on_commit(Record.objects.filter(bicycle_id__in=self.written, modified__gte=started))
+                    restamp_on_commit(Bicycle.objects.filter(id__in=self.written))
+
+                    if self.errors and not options['skip_invalid']:
+                        raise CommandError("{} invalid rows, nothing imported".format(self.errors))
+                    if self.dry_run:
+                        raise _Rollback()
+        except _Rollback:
+            pass
+        except OSError as e:
+            raise CommandError(e)
+
+        self.stdout.write("{} records {}, {} invalid rows".format(
+            self.imported, "valid" if self.dry_run else "imported", self.errors))
+
+    def read_csv(self, file):
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+
+    def read_ndjson(self, file):
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                data = json.loads(text)
+            except ValueError as e:
+                data = {'error': str(e)}
+            if not isinstance(data, dict):
+                data = {'error': "Not an object: {}".format(text.strip())}
+            yield line, data
+
+    def report(self, line, message):
+        self.errors += 1
+        self.stderr.write("line {}: {}".format(line, message))
+
+    # Converts the raw rows. Invalid rows are reported and left out.
+    def parse(self, rows):
+        for line, data in rows:
+            if 'error' in data:
+                self.report(line, data['error'])
+                continue
+
+            try:
+                bicycle = self.bicycle_id(data.get('bicycle'))
+                date = datetime.date.fromisoformat(str(data.get('date')))
+                km = int(data.get('km'))
+            except (TypeError, ValueError) as e:
+                self.report(line, e)
+                continue
+
+            if bicycle is None:
+                self.report(line, "Unknown bicycle {}".format(data.get('bicycle')))
+            elif km < 0:
+                self.report(line, "Negative km {}".format(km))
+            else:
+                yield _Row(line, bicycle, date, km)
+
+    # Resolves a bicycle's id or name, cached per file
+    def bicycle_id(self, key):
+        key = str(key).strip()
+        if key not in self.bicycles:
+            bicycles = Bicycle.objects.filter(pk=int(key)) if key.isdigit() else Bicycle.objects.filter(name=key)
+            self.bicycles[key] = bicycles.values_list('id', flat=True).first()
+        return self.bicycles[key]
+
+    def import_rows(self, rows):
+        batch = []
+        bicycle = None
+        done = set()
+        # existing records of the current bicycle, merged in by date
+        existing = None
+
+        try:
+            for row in self.parse(rows):
+                if row.bicycle != bicycle:
+                    if row.bicycle in done:
+                        self.report(row.line, "File is not sorted by bicycle")
+                        continue
+                    if existing is not None:
+                        done.add(bicycle)
+                        existing.close()
+
+                    bicycle = row.bicycle
+                    # bulk_create doesn't send signals
+                    bicycles_changed([bicycle])
+                    existing = Record.objects.filter(bicycle_id=bicycle).select_related(None).order_by('date').only('date', 'km').iterator()
+                    following = next(existing, None)
+                    previous = None
+
+                if previous is not None and row.date < previous.date:
+                    self.report(row.line, "File is not sorted by date")
+                    continue
+
+                while following is not None and following.date <= row.date:
+                    previous = following
+                    following = next(existing, None)
+
+                try:
+                    check_record_neighbours(row.date, row.km, previous, following)
+                except forms.ValidationError as e:
+                    self.report(row.line, " ".join(e.messages))
+                    continue
+
+                previous = row
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self.write(batch)
+                    batch = []
+        finally:
+            if existing is not None:
+                existing.close()
+
+        self.write(batch)
+
+    def write(self, batch):
+        if not self.dry_run:
+            Record.objects.bulk_create([Record(bicycle_id=row.bicycle, date=row.date, km=row.km) for row in batch])
+            self.written.update(row.bicycle for row in batch)
+        self.imported += len(batch)
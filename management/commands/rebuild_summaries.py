@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myequis import summary
+
+
+# The summaries are maintained by signals, but bulk operations and changes
+# outside of Django bypass them.
+class Command(BaseCommand):
+    help = "Rebuild the bicycle summaries from the records and materials"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only compare the summaries with the data, don't rebuild")
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            summary.rebuild()
+
+        differences = summary.verify()
+        for bicycle_id, field, stored, computed in differences:
+            self.stderr.write("bicycle {}: {} is {}, expected {}".format(bicycle_id, field, stored, computed))
+
+        if differences:
+            raise CommandError("{} differences".format(len(differences)))
+
+        self.stdout.write("Summaries are consistent")
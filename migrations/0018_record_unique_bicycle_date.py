@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Records of the same bicycle and day are merged into the one with the greatest km,
+# the materials mounted or dismounted at the others are moved to it
+def merge_duplicates(apps, schema_editor):
+    Material = apps.get_model('myequis', 'Material')
+    Record = apps.get_model('myequis', 'Record')
+
+    duplicates = Record.objects.values('bicycle_id', 'date').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in list(duplicates):
+        records = list(Record.objects.filter(bicycle_id=duplicate['bicycle_id'], date=duplicate['date'])
+                       .order_by('-km', 'id').values_list('id', flat=True))
+        keep, others = records[0], records[1:]
+        Material.objects.filter(mount_record_id__in=others).update(mount_record_id=keep)
+        Material.objects.filter(dismount_record_id__in=others).update(dismount_record_id=keep)
+        Record.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0017_auto_20190928_2228'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='record',
+            constraint=models.UniqueConstraint(fields=('bicycle', 'date'), name='unique_record_bicycle_date'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:17
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+import django.db.models.deletion
+
+
+def fill_summaries(apps, schema_editor):
+    Bicycle = apps.get_model('myequis', 'Bicycle')
+    BicycleSummary = apps.get_model('myequis', 'BicycleSummary')
+    Material = apps.get_model('myequis', 'Material')
+    Record = apps.get_model('myequis', 'Record')
+
+    for bicycle in Bicycle.objects.all():
+        records = Record.objects.filter(bicycle=bicycle)
+        dates = records.aggregate(first_date=Min('date'), last_date=Max('date'), record_count=Count('id'))
+        km = records.order_by('-date').values_list('km', flat=True).first()
+        materials = Material.objects.filter(mount_record__bicycle=bicycle).aggregate(
+            mounted_count=Count('id', filter=Q(dismount_record=None)), material_cost=Sum('price'))
+
+        BicycleSummary.objects.create(
+            bicycle=bicycle, km=km or 0,
+            mounted_count=materials['mounted_count'], material_cost=materials['material_cost'] or 0,
+            **dates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0018_record_unique_bicycle_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BicycleSummary',
+            fields=[
+                ('bicycle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='myequis.Bicycle')),
+                ('km', models.DecimalField(decimal_places=0, default=0, max_digits=10)),
+                ('first_date', models.DateField(blank=True, null=True)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('record_count', models.PositiveIntegerField(default=0)),
+                ('mounted_count', models.PositiveIntegerField(default=0)),
+                ('material_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
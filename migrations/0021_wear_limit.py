@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0020_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='wear_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Wear limit [km]'),
+        ),
+        migrations.AddField(
+            model_name='part',
+            name='wear_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Wear limit [km]'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# Trigram indexes for the material search on PostgreSQL, see search.py.
+# Other databases use the in-process index.
+INDEXES = [
+    ('myequis_material_name_trgm', 'myequis_material', 'name'),
+    ('myequis_material_manufactor_trgm', 'myequis_material', 'manufactor'),
+    ('myequis_material_size_trgm', 'myequis_material', 'size'),
+    ('myequis_part_name_trgm', 'myequis_part', 'name'),
+    ('myequis_component_name_trgm', 'myequis_component', 'name'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in INDEXES:
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)'.format(
+            name, table, column))
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0021_wear_limit'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
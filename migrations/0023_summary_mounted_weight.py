@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:37
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_mounted(apps, schema_editor):
+    BicycleSummary = apps.get_model('myequis', 'BicycleSummary')
+    Material = apps.get_model('myequis', 'Material')
+
+    for summary in BicycleSummary.objects.all():
+        materials = Material.objects.filter(mount_record__bicycle_id=summary.bicycle_id, dismount_record=None).aggregate(
+            mounted_weight=Sum('Weight [g]'), mounted_cost=Sum('price'))
+        summary.mounted_weight = materials['mounted_weight'] or 0
+        summary.mounted_cost = materials['mounted_cost'] or 0
+        summary.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0022_material_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bicyclesummary',
+            name='mounted_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='bicyclesummary',
+            name='mounted_weight',
+            field=models.DecimalField(decimal_places=3, default=0, max_digits=10),
+        ),
+        migrations.RunPython(fill_mounted, migrations.RunPython.noop),
+    ]
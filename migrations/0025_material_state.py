@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:47
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_state(apps, schema_editor):
+    Material = apps.get_model('myequis', 'Material')
+    Record = apps.get_model('myequis', 'Record')
+
+    Material.objects.filter(mount_record__isnull=False, dismount_record__isnull=False).update(state='dismounted')
+    Material.objects.filter(mount_record__isnull=False, dismount_record=None).update(
+        state='mounted', bicycle_id=Subquery(Record.objects.filter(id=OuterRef('mount_record_id')).values('bicycle_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myequis', '0024_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='bicycle',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mounted_materials', to='myequis.Bicycle'),
+        ),
+        migrations.AddField(
+            model_name='material',
+            name='state',
+            field=models.CharField(choices=[('new', 'New'), ('mounted', 'Mounted'), ('dismounted', 'Dismounted')], default='new', editable=False, max_length=10),
+        ),
+        migrations.RunPython(fill_state, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(state='new'), fields=['name'], name='material_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(state='mounted'), fields=['bicycle', 'part'], name='material_mounted_idx'),
+        ),
+    ]
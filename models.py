@@ -1,10 +1,33 @@
 from django.db import models
+from django.db.models import ExpressionWrapper, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+# Deleting bicycles cascades to all their records and materials. Their receivers are muted,
+# signals.bicycle_deleting does their work once per bicycle.
+class BicycleQuerySet(models.QuerySet):
+
+    def delete(self):
+        from myequis.signals import muted
+        with muted():
+            return super().delete()
+
 
 # A bicycle has Component which are maintained
 class Bicycle(models.Model):
 
     name = models.CharField(max_length=100)
 
+    # Also updated whenever the bicycle's records or materials change
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BicycleQuerySet.as_manager()
+
+    # See BicycleQuerySet
+    def delete(self, *args, **kwargs):
+        from myequis.signals import muted
+        with muted():
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -15,9 +38,18 @@ class Component(models.Model):
 
     name = models.CharField(max_length=100)
     
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    
     def __str__(self):
         return self.name
     
+# Part's string helpers show the component's name, so the component is always joined
+class PartManager(models.Manager):
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('component')
+
+
 # Parts of a component. For instance front wheel: tube, tire, left spokes. 
 # This is a simplified model of the real world. There is no position within a part, e.g. spokes(1)
 class Part(models.Model):
@@ -26,12 +58,26 @@ class Part(models.Model):
 
     component = models.ForeignKey(Component, on_delete=models.CASCADE)
     
+    # Optional, km a material of this part lasts
+    wear_limit = models.PositiveIntegerField("Wear limit [km]", blank=True, null=True)
+    
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = PartManager()
+    
     def display_long_name(self):
         return "{}/{}".format(self.component.name, self.name)    
     
     def __str__(self):
         return "{}/{}".format(self.component.name, self.name)    
 
+# Record's string shows the bicycle's name, so the bicycle is always joined
+class RecordManager(models.Manager):
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('bicycle')
+
+
 # Point in time of a bycicle to record its data
 class Record(models.Model):
 
@@ -40,13 +86,58 @@ class Record(models.Model):
     
     bicycle = models.ForeignKey(Bicycle, on_delete=models.CASCADE)
 
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RecordManager()
+
+    class Meta:
+        # At most one record per day. The unique index on (bicycle, date) also
+        # serves the neighbour lookups of the record validation.
+        constraints = [
+            models.UniqueConstraint(fields=['bicycle', 'date'], name='unique_record_bicycle_date'),
+        ]
+
     def __str__(self):
         return "{} {}".format(self.date, self.bicycle.name)
 
 
+class MaterialQuerySet(models.QuerySet):
+
+    # Joins everything the display helpers (Part.__str__, mounted_in_bicycle) need
+    def with_related(self):
+        return self.select_related('part__component', 'bicycle', 'mount_record__bicycle', 'dismount_record__bicycle')
+
+    # Annotates each material with mileage, the km it has run between its mount_record and
+    # dismount_record. A still mounted material runs until the bicycle's latest record.
+    # mileage is None for materials that have never been mounted. All in one query.
+    def with_mileage(self):
+        latest_km = Record.objects.filter(
+            bicycle=OuterRef('mount_record__bicycle')).order_by('-date').values('km')[:1]
+
+        return self.annotate(
+            mileage=Coalesce(F('dismount_record__km'), Subquery(latest_km)) - F('mount_record__km'))
+    
+    # Annotates each material with mileage and cost_per_km, its price per km run,
+    # None without price or mileage
+    def with_cost_per_km(self):
+        return self.with_mileage().annotate(
+            cost_per_km=ExpressionWrapper(
+                Cast('price', models.FloatField()) / NullIf(F('mileage'), Value(0)), output_field=models.FloatField()))
+
+
 # A material is a physically part of a bicycle. It can be installed at removed, but it must not be used, e.g. when a new tube is bought, it has yet no relation to an bicyle. 
 class Material(models.Model):
 
+    # Lifecycle: bought, mounted at its mount_record, dismounted at its dismount_record
+    NEW = 'new'
+    MOUNTED = 'mounted'
+    DISMOUNTED = 'dismounted'
+    STATES = (
+        (NEW, 'New'),
+        (MOUNTED, 'Mounted'),
+        (DISMOUNTED, 'Dismounted'),
+    )
+
     name = models.CharField(max_length=100)
     
     manufactor = models.CharField(max_length=100)
@@ -57,20 +148,92 @@ class Material(models.Model):
     # Optional 
     part = models.ForeignKey(Part, on_delete=models.CASCADE, blank=True, null=True)
 
+    # Optional, overrides the part's wear_limit
+    wear_limit = models.PositiveIntegerField("Wear limit [km]", blank=True, null=True)
+
     # Optional 
     mount_record = models.ForeignKey(Record, related_name="mount_record", on_delete=models.CASCADE, blank=True, null=True)
     
     # Optional 
     dismount_record = models.ForeignKey(Record, related_name="dismount_record", on_delete=models.CASCADE, blank=True, null=True)
     
+    # Derived from mount_record and dismount_record, so the inventory and the materials
+    # mounted on a bicycle are found without joining the records. Set by save(), the bulk
+    # updates of services.py and fleet.py set them themselves.
+    state = models.CharField(max_length=10, choices=STATES, default=NEW, editable=False)
+    
+    # Bicycle the material is mounted on now
+    bicycle = models.ForeignKey(Bicycle, related_name="mounted_materials", on_delete=models.SET_NULL,
+                                blank=True, null=True, editable=False)
+    
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = MaterialQuerySet.as_manager()
+    
+    class Meta:
+        # Partial, only the rows of the inventory (by name) and of the mounted materials (per bicycle)
+        indexes = [
+            models.Index(fields=['name'], name='material_new_idx', condition=Q(state='new')),
+            models.Index(fields=['bicycle', 'part'], name='material_mounted_idx', condition=Q(state='mounted')),
+        ]
+    
+    # state and bicycle of the material's mount_record and dismount_record
+    def lifecycle(self):
+        if self.mount_record_id is None:
+            return Material.NEW, None
+        if self.dismount_record_id is not None:
+            return Material.DISMOUNTED, None
+        return Material.MOUNTED, self.mount_record.bicycle_id
+    
+    def save(self, *args, **kwargs):
+        self.state, self.bicycle_id = self.lifecycle()
+        super().save(*args, **kwargs)
+    
+    # Name of the bicycle the material is mounted on now
     def mounted_in_bicycle(self):
-        if self.mount_record is None:
+        if self.bicycle_id is None:
             return None
         
-        return self.mount_record.bicycle.name
+        return self.bicycle.name
     
     def __str__(self):
         return self.name
 
 
 
+# Aggregated data of a bicycle for the overview pages, so they don't have to aggregate
+# the records and materials on every request. Maintained by summary.py.
+class BicycleSummary(models.Model):
+
+    bicycle = models.OneToOneField(Bicycle, on_delete=models.CASCADE, primary_key=True, related_name="summary")
+    
+    # km of the latest record
+    km = models.DecimalField(max_digits=10, decimal_places=0, default=0)
+    first_date = models.DateField(blank=True, null=True)
+    last_date = models.DateField(blank=True, null=True)
+    record_count = models.PositiveIntegerField(default=0)
+    
+    # Materials mounted now
+    mounted_count = models.PositiveIntegerField(default=0)
+    
+    # Price of all materials ever mounted
+    material_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    
+    # Weight [g] and price of the materials mounted now
+    mounted_weight = models.DecimalField(max_digits=10, decimal_places=3, default=0)
+    mounted_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return self.bicycle.name
+
+
+# Deleted bicycle, component, part, record or material, for the delta sync (see sync.py)
+class Tombstone(models.Model):
+
+    # Model name, e.g. record
+    model = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    deleted = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return "{} {}".format(self.model, self.object_id)
@@ -0,0 +1,108 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+import threading
+
+from myequis import caching
+from myequis.models import Record
+
+
+# Km of a bicycle at any date and the date it reached any km, interpolated between its records.
+#
+# The records of a bicycle are kept as two sorted arrays, the dates as ordinals and their whole km.
+# They are stored in the cache within the bicycle's scope, so other processes don't need to
+# query them, and in memory until a record of the bicycle changes (see signals.py).
+# The records are validated to never lose km over time, so both arrays are sorted.
+
+
+class Series:
+
+    def __init__(self, days, kms):
+        self.days = days
+        self.kms = kms
+
+    # Km at day, None before the first record. After the last record it stays at its km.
+    def km_at(self, day):
+        ordinal = day.toordinal()
+        position = bisect_right(self.days, ordinal)
+        if position == 0:
+            return None
+        if position == len(self.days) or self.days[position - 1] == ordinal:
+            return self.kms[position - 1]
+
+        day0, day1 = self.days[position - 1], self.days[position]
+        km0, km1 = self.kms[position - 1], self.kms[position]
+        return km0 + (km1 - km0) * (ordinal - day0) // (day1 - day0)
+
+    # First day with at least km, None if it has not been reached yet
+    def date_at(self, km):
+        position = bisect_left(self.kms, km)
+        if position == len(self.kms):
+            return None
+        if position == 0 or self.kms[position] == km:
+            return date.fromordinal(self.days[position])
+
+        day0, day1 = self.days[position - 1], self.days[position]
+        km0, km1 = self.kms[position - 1], self.kms[position]
+        # rounded up to whole days
+        return date.fromordinal(day0 + -(-(day1 - day0) * (km - km0) // (km1 - km0)))
+
+
+def _load(bicycle_id):
+    days = array('q')
+    kms = array('q')
+    records = Record.objects.select_related(None).filter(bicycle_id=bicycle_id).order_by('date')
+    for day, km in records.values_list('date', 'km').iterator():
+        days.append(day.toordinal())
+        kms.append(int(km))
+    return days, kms
+
+
+class SeriesCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # bicycle id: cache versions when loaded, Series
+        self.bicycles = {}
+
+    def series(self, bicycle_id):
+        scope = caching.bicycle_scope(bicycle_id)
+        versions = caching.versions('all', scope)
+
+        with self.lock:
+            loaded = self.bicycles.get(bicycle_id)
+            if loaded is not None and loaded[0] == versions and None not in versions:
+                return loaded[1]
+
+        series = Series(*caching.cached([scope], 'odometer-{}'.format(bicycle_id), lambda: _load(bicycle_id)))
+
+        with self.lock:
+            self.bicycles[bicycle_id] = (versions, series)
+        return series
+
+
+index = SeriesCache()
+
+
+# Interpolated km of the bicycle at day, None before its first record
+def km_at(bicycle_id, day):
+    return index.series(bicycle_id).km_at(day)
+
+
+# Interpolated km of the bicycle at each of the days
+def kms_at(bicycle_id, days):
+    bicycle_series = index.series(bicycle_id)
+    return [bicycle_series.km_at(day) for day in days]
+
+
+# First day the bicycle had at least km, None if not reached yet
+def date_at(bicycle_id, km):
+    return index.series(bicycle_id).date_at(km)
+
+
+def dates_at(bicycle_id, kms):
+    bicycle_series = index.series(bicycle_id)
+    return [bicycle_series.date_at(km) for km in kms]
@@ -0,0 +1,52 @@
+from datetime import date
+
+from django.db.models import Q
+
+
+# Records per page of the records view
+PAGE_SIZE = 50
+
+
+# Keyset pagination of records, newest first.
+# A page is continued after the cursor "<date>_<id>" of its last record. The next page
+# is selected by comparing (date, id) with the cursor instead of an OFFSET, so a deep
+# page is read from the (bicycle, date) index as cheap as the first one.
+# Returns the records of the page and the cursor of the next page, None on the last page.
+def records_page(records, cursor=None, size=PAGE_SIZE):
+    records = records.order_by('-date', '-id')
+
+    key = parse_cursor(cursor)
+    if key is not None:
+        after_date, after_id = key
+        records = records.filter(Q(date__lt=after_date) | Q(date=after_date, id__lt=after_id))
+
+    page = list(records[:size + 1])
+    if len(page) > size:
+        return page[:size], format_cursor(page[size - 1])
+
+    return page, None
+
+
+def format_cursor(record):
+    return "{}_{}".format(record.date.isoformat(), record.id)
+
+
+# The cursor as format_cursor() writes it, None for a missing or invalid one,
+# e.g. to key cached pages by it
+def normalize_cursor(cursor):
+    key = parse_cursor(cursor)
+    if key is None:
+        return None
+    return "{}_{}".format(key[0].isoformat(), key[1])
+
+
+# (date, id) of a cursor, None for a missing or invalid one
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+
+    try:
+        after_date, after_id = cursor.split('_')
+        return date.fromisoformat(after_date), int(after_id)
+    except ValueError:
+        return None
@@ -0,0 +1,287 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.core.signals import request_started
+from django.db.models import CharField, Count, ExpressionWrapper, F, Lookup, Max, Q
+from django.db.models.functions import Greatest
+
+from myequis import caching
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+
+
+# Search of the material inventory over name, manufactor, size and the part's long name.
+#
+# On PostgreSQL with django.contrib.postgres installed, the database searches with the
+# trigram indexes of migration 0022: substrings with ILIKE and fuzzy matches with the
+# similarity operator %, both served by these indexes. Each table is searched on its own,
+# joins with ORs across tables couldn't use them.
+#
+# Otherwise an in-process index is used: trigram postings for substrings, a sorted word list
+# for prefixes and the trigrams of the words for fuzzy matches. It is built on the first
+# search, or in the background on the first request with MYEQUIS_SEARCH_WARM. After the cached materials
+# got invalidated, the next search reloads the materials modified since then
+# (Material.modified is indexed), so every process keeps its index up to date.
+#
+# Settings:
+#   MYEQUIS_SEARCH_WARM  build the in-process index in the background on the first request
+
+# Results of a search
+LIMIT = 50
+
+# Minimum trigram similarity of a fuzzy match, the default pg_trgm.similarity_threshold
+# of the % operator
+SIMILARITY = 0.3
+
+# Materials modified this long before the last seen modification are reloaded too,
+# for transactions committed late
+MARGIN = timedelta(minutes=1)
+
+
+# text__ilike=pattern, unlike icontains (UPPER(field) LIKE ...) served by the trigram indexes
+class ILike(Lookup):
+    lookup_name = 'ilike'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "{} ILIKE {}".format(lhs, rhs), list(lhs_params) + list(rhs_params)
+
+
+# The searched columns as seen by the ILike lookup, which is only registered here
+class _SearchText(CharField):
+    pass
+
+
+_SearchText.register_lookup(ILike)
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', (text or '').lower()).strip()
+
+
+def _trigrams(text):
+    padded = "  {} ".format(text)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _words(text):
+    return set(re.findall(r'\w+', text))
+
+
+# Fields of a material for material_text and the index
+FIELDS = ['id', 'name', 'manufactor', 'size', 'part__component__name', 'part__name', 'state']
+
+
+def material_text(name, manufactor, size, component, part):
+    part = "{}/{}".format(component, part) if part is not None else ''
+    return _normalize(" ".join([name, manufactor, size or '', part]))
+
+
+class MaterialIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.texts = {}
+        # trigram: ids of the texts containing it
+        self.postings = {}
+        # word: ids, the sorted words for prefixes and the trigrams of the words for fuzzy matches
+        self.word_ids = {}
+        self.words = []
+        self.word_trigrams = {}
+        self.unused = set()
+        # cache versions, max modified and count of the materials when last synchronized
+        self.versions = None
+        self.state = None
+
+    # Loads the changes since the last call, everything on the first call.
+    # Every change of a material gets the cached materials a new version (see caching.py),
+    # so the database is only asked when the versions changed or the cache can't tell.
+    def sync(self):
+        versions = caching.versions('all', 'materials')
+        if versions == self.versions and None not in versions:
+            return
+
+        state = Material.objects.aggregate(modified=Max('modified'), count=Count('id'))
+        if self.state is not None and self.state['modified'] is not None:
+            materials = Material.objects.filter(modified__gte=self.state['modified'] - MARGIN)
+        else:
+            self.clear()
+            materials = Material.objects.all()
+
+        for row in materials.values_list(*FIELDS).iterator():
+            self._remove(row[0])
+            self._add(row[0], material_text(*row[1:6]), row[6] == Material.NEW)
+
+        # deleted materials
+        if len(self.texts) != state['count']:
+            ids = set(Material.objects.values_list('id', flat=True))
+            for id in set(self.texts) - ids:
+                self._remove(id)
+
+        self.versions = versions
+        self.state = state
+
+    def _add(self, id, text, unused):
+        self.texts[id] = text
+        for trigram in _trigrams(text):
+            self.postings.setdefault(trigram, set()).add(id)
+
+        for word in _words(text):
+            if word not in self.word_ids:
+                self.word_ids[word] = set()
+                insort(self.words, word)
+                for trigram in _trigrams(word):
+                    self.word_trigrams.setdefault(trigram, set()).add(word)
+            self.word_ids[word].add(id)
+
+        if unused:
+            self.unused.add(id)
+
+    # Words stay known without materials, they just don't match any
+    def _remove(self, id):
+        text = self.texts.pop(id, None)
+        if text is None:
+            return
+        for trigram in _trigrams(text):
+            self.postings[trigram].discard(id)
+        for word in _words(text):
+            self.word_ids[word].discard(id)
+        self.unused.discard(id)
+
+    # Ids of the best matches: substring matches, then materials with a word starting with the
+    # query, then those with a word similar to the query by trigram similarity
+    def search(self, query, unused=False, limit=LIMIT):
+        query = _normalize(query)
+        if not query:
+            return []
+
+        with self.lock:
+            self.sync()
+
+            found = []
+            seen = set()
+
+            # in order of the ids, until the limit is reached
+            def add(ids, matches=None):
+                for id in sorted(ids):
+                    if len(found) >= limit:
+                        return
+                    if id in seen or (unused and id not in self.unused):
+                        continue
+                    if matches is None or matches(id):
+                        seen.add(id)
+                        found.append(id)
+
+            # substrings contain all the query's trigrams, except the padded ones at its ends
+            trigrams = _trigrams(query)
+            inner = [trigram for trigram in trigrams if trigram.strip() == trigram]
+            if inner:
+                postings = sorted((self.postings.get(trigram, set()) for trigram in inner), key=len)
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self.texts
+            add(candidates, lambda id: query in self.texts[id])
+
+            position = bisect_left(self.words, query)
+            while len(found) < limit and position < len(self.words) and self.words[position].startswith(query):
+                add(self.word_ids[self.words[position]])
+                position += 1
+
+            if len(found) < limit:
+                counts = {}
+                for trigram in trigrams:
+                    for word in self.word_trigrams.get(trigram, ()):
+                        counts[word] = counts.get(word, 0) + 1
+                scores = sorted(((count / len(trigrams | _trigrams(word)), word)
+                                 for word, count in counts.items()), reverse=True)
+                for score, word in scores:
+                    if score < SIMILARITY or len(found) >= limit:
+                        break
+                    add(self.word_ids[word])
+
+            return found
+
+
+index = MaterialIndex()
+
+
+def database_search():
+    return (connection.vendor == 'postgresql'
+            and 'django.contrib.postgres' in settings.INSTALLED_APPS)
+
+
+# Builds the in-process index, e.g. in the background
+def warm():
+    with index.lock:
+        index.sync()
+
+
+# Receiver of the first request of the process, starts warm() in the background.
+# Management commands like migrate don't handle requests, so they never build the index.
+def warm_on_first_request(**kwargs):
+    # only one of concurrent first requests disconnects it
+    if request_started.disconnect(warm_on_first_request) and not database_search():
+        threading.Thread(target=warm, daemon=True).start()
+
+
+# The rows of queryset with one of the fields containing or similar to query
+def _matching(queryset, fields, query, pattern):
+    texts = {'text_' + field: ExpressionWrapper(F(field), output_field=_SearchText()) for field in fields}
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{'text_{}__ilike'.format(field): pattern}) | Q(**{field + '__trigram_similar': query})
+    return queryset.annotate(**texts).filter(condition)
+
+
+def _similarity(query, fields):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    similarities = [TrigramSimilarity(field, query) for field in fields]
+    return Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+
+
+# Ids of the up to limit most similar materials matching by their own fields, their part
+# or their component, each by the indexes of its table. The overall best ones are among them.
+def _candidates(query, materials, limit):
+    pattern = "%{}%".format(connection.ops.prep_for_like_query(query))
+
+    def best(queryset, *fields):
+        return list(queryset.annotate(similarity=_similarity(query, fields)).order_by('-similarity')
+                    .values_list('id', flat=True)[:limit])
+
+    ids = best(_matching(materials, ['name', 'manufactor', 'size'], query, pattern), 'name', 'manufactor', 'size')
+
+    parts = list(_matching(Part.objects.select_related(None), ['name'], query, pattern).values_list('id', flat=True))
+    if parts:
+        ids += best(materials.filter(part_id__in=parts), 'part__name')
+
+    components = list(_matching(Component.objects.all(), ['name'], query, pattern).values_list('id', flat=True))
+    if components:
+        ids += best(materials.filter(part__component_id__in=components), 'part__component__name')
+
+    return ids
+
+
+# Best matching materials for query, optionally only unused ones
+def search(query, unused=False, limit=LIMIT):
+    if database_search():
+        materials = Material.objects.all()
+        if unused:
+            materials = materials.filter(state=Material.NEW)
+
+        fields = ['name', 'manufactor', 'size', 'part__name', 'part__component__name']
+        return list(Material.objects.with_related().filter(id__in=_candidates(query, materials, limit)).annotate(
+            similarity=_similarity(query, fields)).order_by('-similarity', 'name')[:limit])
+
+    ids = index.search(query, unused, limit)
+    materials = Material.objects.with_related().in_bulk(ids)
+    return [materials[id] for id in ids if id in materials]
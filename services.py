@@ -0,0 +1,76 @@
+from django import forms
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from myequis import caching
+from myequis.forms import check_record_neighbours
+from myequis.models import Material
+from myequis.models import Record
+from myequis.signals import bicycles_changed
+
+
+# Services changing several models at once
+
+
+# The record of the bicycle at date, created with km if there is none yet.
+# A new record is checked against its neighbours like RecordForm does, an existing one
+# must have the km.
+def record_at(bicycle_id, date, km):
+    record = Record.objects.filter(bicycle_id=bicycle_id, date=date).first()
+    if record is not None:
+        if record.km != km:
+            raise forms.ValidationError(
+                _("The record of %(date)s has %(km)s km"), code="record_km_differs",
+                params={'date': date, 'km': record.km})
+        return record
+
+    records = Record.objects.filter(bicycle_id=bicycle_id)
+    previous = records.filter(date__lt=date).order_by('-date').first()
+    following = records.filter(date__gt=date).order_by('date').first()
+    check_record_neighbours(date, km, previous, following)
+
+    return Record.objects.create(bicycle_id=bicycle_id, date=date, km=km)
+
+
+# Service of a bicycle: at one record (reused or created for date), the materials mounted on
+# the parts of the new materials and on dismount_parts are dismounted, then the new materials
+# (ids, unused ones with a part) are mounted.
+#
+# Runs in one transaction with bulk updates, so the number of queries doesn't depend on
+# the number of materials. Raises forms.ValidationError if the swap is not possible.
+# Returns the record and the numbers of dismounted and mounted materials.
+def swap_materials(bicycle_id, date, km, mount=(), dismount_parts=()):
+    with transaction.atomic():
+        record = record_at(bicycle_id, date, km)
+
+        new = list(Material.objects.select_for_update().filter(id__in=mount).values_list(
+            'id', 'part_id', 'state'))
+        if len(new) != len(set(mount)):
+            raise forms.ValidationError(_("Unknown material"), code="material_unknown")
+        if any(state != Material.NEW for id, part_id, state in new):
+            raise forms.ValidationError(_("Material is already in use"), code="material_used")
+        if any(part_id is None for id, part_id, state in new):
+            raise forms.ValidationError(_("Material has no part"), code="material_without_part")
+
+        new_parts = [part_id for id, part_id, state in new]
+        if len(new_parts) != len(set(new_parts)):
+            raise forms.ValidationError(_("Only one material per part can be mounted"), code="part_twice")
+
+        mounted = Material.objects.filter(
+            bicycle_id=bicycle_id, state=Material.MOUNTED, part_id__in=set(new_parts) | set(dismount_parts))
+        if mounted.filter(mount_record__date__gt=record.date).exists():
+            raise forms.ValidationError(
+                _("A material was mounted after %(date)s"), code="mounted_later", params={'date': record.date})
+
+        now = timezone.now()
+        # update() doesn't call Material.save(), the states are set here
+        dismounted = mounted.update(dismount_record=record, state=Material.DISMOUNTED, bicycle=None, modified=now)
+        mounted = Material.objects.filter(id__in=mount).update(
+            mount_record=record, state=Material.MOUNTED, bicycle_id=bicycle_id, modified=now)
+
+        # update() doesn't send signals
+        bicycles_changed([bicycle_id], history=False)
+        caching.invalidate('materials')
+
+    return record, dismounted, mounted
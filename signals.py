@@ -0,0 +1,225 @@
+from contextlib import contextmanager
+import threading
+
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from myequis import caching
+from myequis import summary
+from myequis.models import Bicycle
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+from myequis.models import Record
+from myequis.models import Tombstone
+
+
+_state = threading.local()
+
+
+# Within, the receivers of changed records and materials do nothing, for bulk operations
+# that do their work once for all rows
+@contextmanager
+def muted():
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def _muted():
+    return getattr(_state, 'muted', False)
+
+
+# Everything derived from the records and materials of the bicycles must be updated:
+# their modification time for the conditional GETs, their summaries and cached values.
+# The fleet's values contain the summaries.
+# Without history, only records of the current month changed, if any.
+# Without refresh, the caller applied the changes to the summaries itself.
+# Without mounts, no material's mount or dismount date changed.
+def bicycles_changed(bicycle_ids, history=True, refresh=True, mounts=True):
+    bicycle_ids = set(bicycle_ids) - {None}
+    if bicycle_ids:
+        Bicycle.objects.filter(pk__in=bicycle_ids).update(modified=timezone.now())
+
+    if refresh:
+        for bicycle_id in bicycle_ids:
+            summary.schedule_refresh(bicycle_id)
+
+    if bicycle_ids:
+        caching.invalidate('fleet', *(caching.bicycle_scope(id) for id in bicycle_ids))
+    if bicycle_ids and history:
+        caching.invalidate('history', *(caching.history_scope(id) for id in bicycle_ids))
+    if bicycle_ids and mounts:
+        caching.invalidate(*(caching.mount_scope(id) for id in bicycle_ids))
+
+
+# Whether records at dates belong to the history, the months before the current one
+def in_history(dates):
+    return min(dates) < timezone.localdate().replace(day=1)
+
+
+# Bicycles of a material's mount and dismount records, by record id
+def material_bicycles(material):
+    ids = [id for id in (material.mount_record_id, material.dismount_record_id) if id is not None]
+    if not ids:
+        return {}
+    return dict(Record.objects.select_related(None).filter(id__in=ids).values_list('id', 'bicycle_id'))
+
+
+@receiver(post_save, sender=Bicycle)
+def bicycle_saved(sender, instance, created, **kwargs):
+    if created:
+        summary.schedule_refresh(instance.id)
+    caching.invalidate('fleet', caching.bicycle_scope(instance.id))
+
+
+# The work of the muted receivers of the bicycle's records and materials, see BicycleQuerySet
+@receiver(pre_delete, sender=Bicycle)
+def bicycle_deleting(sender, instance, **kwargs):
+    if not _muted():
+        return
+
+    records = list(Record.objects.select_related(None).filter(bicycle_id=instance.id).values_list('id', flat=True))
+    materials = list(Material.objects.filter(
+        Q(mount_record__bicycle_id=instance.id) | Q(dismount_record__bicycle_id=instance.id)).values_list(
+        'id', 'mount_record__bicycle_id', 'dismount_record__bicycle_id'))
+
+    Tombstone.objects.bulk_create(
+        [Tombstone(model='bicycle', object_id=instance.id)]
+        + [Tombstone(model='record', object_id=id) for id in records]
+        + [Tombstone(model='material', object_id=id) for id, mounted, dismounted in materials])
+
+    # materials moved between bicycles
+    others = {bicycle_id for id, mounted, dismounted in materials for bicycle_id in (mounted, dismounted)}
+    bicycles_changed(others - {instance.id}, history=False)
+    caching.invalidate('history', 'materials', caching.history_scope(instance.id))
+
+
+@receiver(post_delete, sender=Bicycle)
+def bicycle_deleted(sender, instance, **kwargs):
+    caching.invalidate('fleet', caching.bicycle_scope(instance.id), caching.mount_scope(instance.id))
+
+
+@receiver(post_save, sender=Component)
+@receiver(post_delete, sender=Component)
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def catalog_changed(sender, instance, **kwargs):
+    caching.invalidate('catalog')
+
+
+# The materials are shown with their part's long name, e.g. by the search
+@receiver(post_save, sender=Component)
+def component_saved(sender, instance, created, **kwargs):
+    if not created:
+        Material.objects.filter(part__component=instance).update(modified=timezone.now())
+        caching.invalidate('materials')
+
+
+@receiver(post_save, sender=Part)
+def part_saved(sender, instance, created, **kwargs):
+    if not created:
+        Material.objects.filter(part=instance).update(modified=timezone.now())
+        caching.invalidate('materials')
+
+
+# A changed record or material may have belonged to another bicycle before
+@receiver(pre_save, sender=Record)
+def record_saving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        previous = Record.objects.select_related(None).filter(pk=instance.pk).values_list('bicycle_id', 'date')
+        instance._previous_bicycle_ids = {bicycle_id for bicycle_id, date in previous}
+        instance._previous_dates = {date for bicycle_id, date in previous}
+
+
+@receiver(post_save, sender=Record)
+@receiver(post_delete, sender=Record)
+def record_changed(sender, instance, signal, **kwargs):
+    if _muted():
+        return
+    # the date may have been given as a string
+    day = sender._meta.get_field('date').to_python(instance.date)
+    dates = getattr(instance, '_previous_dates', set()) | {day}
+    previous = getattr(instance, '_previous_bicycle_ids', set())
+
+    # number of records each bicycle gained
+    if signal is post_delete:
+        counts = {instance.bicycle_id: -1}
+    else:
+        counts = {bicycle_id: -1 for bicycle_id in previous}
+        counts[instance.bicycle_id] = counts.get(instance.bicycle_id, 0) + 1
+    for bicycle_id, count in counts.items():
+        summary.records_changed(bicycle_id, count)
+
+    # The materials mounted or dismounted at an existing record moved with it.
+    # Those of a deleted one are deleted with it, see material_changed.
+    moved = signal is post_save and bool(previous) and (
+        previous != {instance.bicycle_id} or instance._previous_dates != {day})
+    bicycles_changed(previous | {instance.bicycle_id}, history=in_history(dates), refresh=False, mounts=moved)
+
+
+# Materials mounted at a record moved to another bicycle are mounted on that bicycle now,
+# and counted in its summary
+@receiver(post_save, sender=Record)
+def record_moved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_bicycle_ids', {instance.bicycle_id})
+    if previous != {instance.bicycle_id}:
+        materials = Material.objects.filter(mount_record=instance)
+        if not _muted():
+            totals = summary.material_totals(materials)
+            for bicycle_id in previous:
+                summary.add(bicycle_id, totals, -1)
+            summary.add(instance.bicycle_id, totals)
+
+        if materials.filter(state=Material.MOUNTED).update(bicycle_id=instance.bicycle_id, modified=timezone.now()):
+            caching.invalidate('materials')
+
+
+@receiver(pre_save, sender=Material)
+def material_saving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        previous = Material.objects.filter(pk=instance.pk).values_list(
+            'mount_record__bicycle_id', 'dismount_record__bicycle_id', 'state', 'price', 'Weight [g]').first()
+        if previous is not None:
+            mounted, dismounted, state, price, weight = previous
+            instance._previous_bicycle_ids = {mounted, dismounted}
+            # what the material added to the summary of the bicycle it was mounted on
+            instance._previous_share = mounted, summary.material_share(state, price, weight)
+
+
+# The material's share of the summaries is moved from the previous to the current values
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def material_changed(sender, instance, signal, **kwargs):
+    if _muted():
+        return
+    bicycles = material_bicycles(instance)
+    share = summary.material_share(instance.state, instance.price, getattr(instance, 'Weight [g]'))
+
+    if signal is post_delete:
+        summary.add(bicycles.get(instance.mount_record_id), share, -1)
+    else:
+        if hasattr(instance, '_previous_share'):
+            summary.add(*instance._previous_share, -1)
+        summary.add(bicycles.get(instance.mount_record_id), share)
+
+    caching.invalidate('materials')
+    bicycles_changed(getattr(instance, '_previous_bicycle_ids', set()) | set(bicycles.values()),
+                     history=False, refresh=False)
+
+
+# Deletions are kept for the delta sync
+@receiver(post_delete, sender=Bicycle)
+@receiver(post_delete, sender=Component)
+@receiver(post_delete, sender=Part)
+@receiver(post_delete, sender=Record)
+@receiver(post_delete, sender=Material)
+def keep_tombstone(sender, instance, **kwargs):
+    if _muted():
+        return
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk)
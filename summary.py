@@ -0,0 +1,123 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from myequis.models import Bicycle
+from myequis.models import BicycleSummary
+from myequis.models import Material
+from myequis.models import Record
+
+
+# Fields of BicycleSummary computed from the bicycle's records and materials.
+# Uses the (bicycle, date) index, so the costs are per bicycle, not per fleet.
+# Only for bulk changes, rebuild() and verify(); single changes are applied by
+# records_changed() and add().
+def compute(bicycle_id):
+    records = Record.objects.filter(bicycle_id=bicycle_id).aggregate(
+        record_count=Count('id'), first_date=Min('date'), last_date=Max('date'))
+
+    km = Record.objects.filter(bicycle_id=bicycle_id).order_by('-date').values_list('km', flat=True).first()
+
+    return dict(
+        km=km or 0,
+        first_date=records['first_date'],
+        last_date=records['last_date'],
+        record_count=records['record_count'],
+        **material_totals(Material.objects.filter(mount_record__bicycle_id=bicycle_id)))
+
+
+# The material fields of BicycleSummary summed over the materials
+def material_totals(materials):
+    mounted = Q(state=Material.MOUNTED)
+    totals = materials.aggregate(
+        mounted_count=Count('id', filter=mounted), material_cost=Sum('price'),
+        mounted_weight=Sum('Weight [g]', filter=mounted), mounted_cost=Sum('price', filter=mounted))
+    return {field: value or 0 for field, value in totals.items()}
+
+
+# The material fields of BicycleSummary of one material with the state, price and weight
+def material_share(state, price, weight):
+    mounted = state == Material.MOUNTED
+    return {
+        'mounted_count': 1 if mounted else 0,
+        'material_cost': price or 0,
+        'mounted_weight': (weight or 0) if mounted else 0,
+        'mounted_cost': (price or 0) if mounted else 0,
+    }
+
+
+# Adds the values to the bicycle's summary fields, subtracts them with sign -1.
+# One UPDATE, a missing summary is created by its pending refresh.
+def add(bicycle_id, values, sign=1):
+    values = {field: F(field) + sign * value for field, value in values.items() if value}
+    if bicycle_id is not None and values:
+        BicycleSummary.objects.filter(bicycle_id=bicycle_id).update(**values)
+
+
+# Applies saved or deleted records of the bicycle to its summary: the count is changed
+# by the difference, the first and last record are looked up by the (bicycle, date) index
+# within the same UPDATE instead of aggregating the history.
+def records_changed(bicycle_id, count=0):
+    records = Record.objects.select_related(None).filter(bicycle_id=bicycle_id)
+    first = records.order_by('date')
+    last = records.order_by('-date')
+    BicycleSummary.objects.filter(bicycle_id=bicycle_id).update(
+        record_count=F('record_count') + count,
+        first_date=Subquery(first.values('date')[:1]),
+        last_date=Subquery(last.values('date')[:1]),
+        km=Coalesce(Subquery(last.values('km')[:1]), Value(0)))
+
+
+def refresh(bicycle_id):
+    # The bicycle may be deleted meanwhile
+    if Bicycle.objects.filter(pk=bicycle_id).exists():
+        BicycleSummary.objects.update_or_create(bicycle_id=bicycle_id, defaults=compute(bicycle_id))
+
+
+# Refreshes the summary when the current transaction is committed. Immediately without one.
+def schedule_refresh(bicycle_id):
+    if bicycle_id is not None:
+        transaction.on_commit(partial(refresh, bicycle_id))
+
+
+# Fleet-wide totals over all summaries, in one query
+def fleet():
+    return BicycleSummary.objects.aggregate(
+        km=Sum('km'), first_date=Min('first_date'), last_date=Max('last_date'),
+        record_count=Sum('record_count'), mounted_count=Sum('mounted_count'),
+        material_cost=Sum('material_cost'), mounted_weight=Sum('mounted_weight'),
+        mounted_cost=Sum('mounted_cost'))
+
+
+# Weight [g] and price of the materials mounted now on the bicycle per component, in one query.
+# Materials without part are counted for component None.
+def components(bicycle_id):
+    return list(Material.objects.filter(bicycle_id=bicycle_id, state=Material.MOUNTED).values(
+        component=F('part__component__name')).annotate(
+        count=Count('id'), weight=Sum('Weight [g]'), cost=Sum('price')).order_by('component'))
+
+
+# Recomputes all summaries
+def rebuild():
+    with transaction.atomic():
+        BicycleSummary.objects.all().delete()
+        BicycleSummary.objects.bulk_create(
+            BicycleSummary(bicycle_id=id, **compute(id)) for id in Bicycle.objects.values_list('id', flat=True))
+
+
+# Compares the stored summaries with freshly computed ones.
+# Returns a list of (bicycle_id, field, stored, computed) for each difference.
+def verify():
+    stored = {summary.bicycle_id: summary for summary in BicycleSummary.objects.all()}
+    differences = []
+
+    for id in Bicycle.objects.values_list('id', flat=True):
+        summary = stored.get(id)
+        for field, value in compute(id).items():
+            current = None if summary is None else getattr(summary, field)
+            if current != value:
+                differences.append((id, field, current, value))
+
+    return differences
@@ -0,0 +1,134 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from myequis.models import Bicycle
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+from myequis.models import Record
+from myequis.models import Tombstone
+
+
+# Delta sync for offline clients: the rows created, updated or deleted since a cursor.
+#
+# All changes are ordered by (modification time, stream, id), where stream is the position
+# of the model in STREAMS, the deletions (tombstones) come last. A cursor is the key of the
+# last change a client has got, so every page is a keyset query on the indexed modification
+# times of each model.
+#
+# The modification times are set before the transactions commit, so a change may become
+# visible after later ones. A completed sync therefore returns a cursor up to MARGIN
+# before now, the next sync sends these changes again. Clients just replace the rows.
+#
+# Rows of transactions committed more than MARGIN after they were written would be missed.
+# Writers that may run that long, like import_records and fleet.generate, stamp their rows
+# again when they commit (restamp_on_commit).
+
+# Name, model and fields of each stream, the rows are sent as lists in this order
+STREAMS = [
+    ('bicycle', Bicycle, ['id', 'name']),
+    ('component', Component, ['id', 'name']),
+    ('part', Part, ['id', 'component_id', 'name', 'wear_limit']),
+    ('record', Record, ['id', 'bicycle_id', 'date', 'km']),
+    ('material', Material, ['id', 'name', 'manufactor', 'size', 'price', 'Weight [g]', 'part_id',
+                            'wear_limit', 'mount_record_id', 'dismount_record_id', 'state', 'bicycle_id']),
+]
+
+DELETED = len(STREAMS)
+
+# Changes per page
+LIMIT = 500
+
+MARGIN = timedelta(minutes=1)
+
+
+# Sets the modification time of the rows of queryset to the time the current transaction
+# is committed
+def restamp_on_commit(queryset):
+    transaction.on_commit(lambda: queryset.select_related(None).update(modified=timezone.now()))
+
+
+# Raised for a cursor that can't be parsed
+class InvalidCursor(ValueError):
+    pass
+
+
+# Times are in UTC, written with Z, so the cursor can be passed in a URL as it is
+def format_cursor(key):
+    modified, stream, id = key
+    return "{}_{}_{}".format(modified.isoformat().replace('+00:00', 'Z'), stream, id)
+
+
+def parse_cursor(cursor):
+    try:
+        modified, stream, id = cursor.split('_')
+        modified = parse_datetime(modified)
+        if modified is None:
+            raise ValueError(cursor)
+        return modified, int(stream), int(id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+# Rows of the stream after the key, ordered by their keys
+def _after(queryset, field, stream, key):
+    if key is not None:
+        modified, key_stream, key_id = key
+        later = Q(**{field + '__gt': modified})
+        if stream > key_stream:
+            later |= Q(**{field: modified})
+        elif stream == key_stream:
+            later |= Q(**{field: modified, 'id__gt': key_id})
+        queryset = queryset.filter(later)
+    return queryset.order_by(field, 'id')
+
+
+# Changes after the cursor, from the start without one. Returns a dict with
+#   fields:   stream name: names of the fields of its rows
+#   changes:  stream name: rows as lists of their fields, for created and updated rows
+#   deleted:  stream name: ids
+#   cursor:   for the next call
+#   more:     whether there are more changes
+def changes(cursor=None, limit=LIMIT):
+    key = parse_cursor(cursor) if cursor else None
+    now = timezone.now()
+
+    # up to limit changes of each stream and one more to know if there are more, keyed like the cursor
+    found = []
+    for stream, (name, model, fields) in enumerate(STREAMS):
+        rows = _after(model.objects.select_related(None), 'modified', stream, key)
+        for row in rows.values_list('modified', *fields)[:limit + 1]:
+            found.append(((row[0], stream, row[1]), name, list(row[1:])))
+
+    tombstones = _after(Tombstone.objects.all(), 'deleted', DELETED, key)
+    for tombstone in tombstones.values_list('deleted', 'id', 'model', 'object_id')[:limit + 1]:
+        found.append(((tombstone[0], DELETED, tombstone[1]), tombstone[2], tombstone[3]))
+
+    found.sort(key=lambda change: change[0])
+    more = len(found) > limit
+    found = found[:limit]
+
+    result = {
+        'fields': {name: fields for name, model, fields in STREAMS},
+        'changes': {},
+        'deleted': {},
+        'more': more,
+    }
+    for change_key, name, row in found:
+        if change_key[1] == DELETED:
+            result['deleted'].setdefault(name, []).append(row)
+        else:
+            result['changes'].setdefault(name, []).append(row)
+
+    last = found[-1][0] if found else key
+    if not more:
+        # changes of transactions still running may show up with an earlier time
+        margin = (now - MARGIN, -1, 0)
+        last = margin if last is None else min(last, margin)
+    result['cursor'] = format_cursor(last)
+
+    return result
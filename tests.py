@@ -1,3 +1,783 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+import json
+import os
+import tempfile
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_started
+from django.db import connection, transaction
+from django.template.backends.django import Template as DjangoTemplate
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from myequis import caching
+from myequis import compaction
+from myequis import configuration
+from myequis import distances
+from myequis import forecast
+from myequis import gpx
+from myequis import instrumentation
+from myequis import odometer
+from myequis import search
+from myequis import services
+from myequis import summary
+from myequis import sync
+from myequis import tree
+from myequis.forms import RecordForm
+from myequis.models import Bicycle
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+from myequis.models import Record
+from myequis.models import Tombstone
+
+
+# The number of queries of a page must not depend on the number of rows it shows
+class QueryCountTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.bicycle = Bicycle.objects.create(name="Road")
+        self.rows = 0
+
+    # Adds n records, parts and materials (mounted and unused) to the fleet
+    def grow(self, n):
+        for i in range(self.rows, self.rows + n):
+            bicycle = Bicycle.objects.create(name="Bicycle {}".format(i))
+            component = Component.objects.create(name="Component {}".format(i))
+            part = Part.objects.create(name="Part {}".format(i), component=component)
+            record = Record.objects.create(bicycle=self.bicycle, date=date(2019, 1, 1) + timedelta(days=i), km=i)
+            Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=0)
+            Material.objects.create(name="Mounted {}".format(i), manufactor="M", part=part, mount_record=record)
+            Material.objects.create(name="Unused {}".format(i), manufactor="M", part=part)
+        self.rows += n
+
+    # Without the cache
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertConstantQueries(self, url):
+        self.grow(1)
+        # warm up caches like the content types
+        self.count_queries(url)
+        few = self.count_queries(url)
+        self.grow(10)
+        many = self.count_queries(url)
+        self.assertEqual(few, many, url)
+
+    def test_views(self):
+        self.client.force_login(self.user)
+        for url in [
+                reverse('myequis:index'),
+                reverse('myequis:bicycle', args=(self.bicycle.id,)),
+                reverse('myequis:records', args=(self.bicycle.id,)),
+                reverse('myequis:create_record', args=(self.bicycle.id,)),
+                reverse('myequis:newmaterials'),
+        ]:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_record_view(self):
+        self.grow(1)
+        record = Record.objects.first()
+        self.assertConstantQueries(reverse('myequis:record', args=(record.id,)))
+
+    def test_admin(self):
+        self.client.force_login(self.user)
+        for url in [
+                reverse('admin:myequis_bicycle_changelist'),
+                reverse('admin:myequis_component_changelist'),
+                reverse('admin:myequis_material_changelist'),
+                reverse('admin:myequis_material_add'),
+                reverse('admin:myequis_record_changelist'),
+                reverse('admin:myequis_part_changelist'),
+                reverse('admin:myequis_record_autocomplete') + '?term=road',
+                reverse('admin:myequis_bicycle_change', args=(self.bicycle.id,)),
+        ]:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+
+class RecordFormTests(TestCase):
+
+    def setUp(self):
+        self.bicycle = Bicycle.objects.create(name="Road")
+        self.first = Record.objects.create(bicycle=self.bicycle, date=date(2019, 1, 1), km=100)
+        self.second = Record.objects.create(bicycle=self.bicycle, date=date(2019, 1, 10), km=500)
+
+    def errors(self, data, bicycle_id, record_id=None):
+        form = RecordForm(data)
+        form.enable_validations(bicycle_id, record_id=record_id)
+        form.is_valid()
+        return [error.code for error in form.non_field_errors().as_data()]
+
+    def test_new_record(self):
+        self.assertEqual(self.errors({'id': '', 'date': date(2019, 1, 5), 'km': 300}, self.bicycle.id), [])
+        self.assertEqual(self.errors({'id': '', 'date': date(2019, 1, 1), 'km': 100}, self.bicycle.id),
+                         ["record_date_dublicate"])
+        self.assertEqual(self.errors({'id': '', 'date': date(2019, 1, 5), 'km': 50}, self.bicycle.id),
+                         ["record_date_dublicate"])
+        self.assertEqual(self.errors({'id': '', 'date': date(2019, 1, 5), 'km': 600}, self.bicycle.id),
+                         ["record_date_dublicate"])
+
+    def test_edited_record(self):
+        def errors(record, data):
+            return self.errors(data, self.bicycle.id, record.id)
+
+        # the record itself is no neighbour
+        self.assertEqual(errors(self.second, {'id': self.second.id, 'date': date(2019, 1, 10), 'km': 400}), [])
+        self.assertEqual(errors(self.second, {'id': self.second.id, 'date': date(2019, 1, 1), 'km': 500}),
+                         ["record_date_dublicate"])
+        self.assertEqual(errors(self.second, {'id': self.second.id, 'date': date(2019, 1, 10), 'km': 50}),
+                         ["record_date_dublicate"])
+        self.assertEqual(errors(self.first, {'id': self.first.id, 'date': date(2019, 1, 1), 'km': 600}),
+                         ["record_date_dublicate"])
+
+    def test_edit_record_view(self):
+        other = Bicycle.objects.create(name="Gravel")
+        foreign = Record.objects.create(bicycle=other, date=date(2019, 1, 5), km=10)
+        url = reverse('myequis:record', args=(self.second.id,))
+
+        # the posted id doesn't matter, the edited record is checked
+        for id in ['', foreign.id]:
+            with self.subTest(id=id):
+                response = self.client.post(url, {'id': id, 'date': '2019-01-01', 'km': 500})
+                self.assertEqual(response.status_code, 200)
+                response = self.client.post(url, {'id': id, 'date': '2019-01-10', 'km': 50})
+                self.assertEqual(response.status_code, 200)
+                self.second.refresh_from_db()
+                self.assertEqual((self.second.date, int(self.second.km)), (date(2019, 1, 10), 500))
+
+        response = self.client.post(url, {'id': '', 'date': '2019-01-12', 'km': 550})
+        self.assertEqual(response.status_code, 302)
+        self.second.refresh_from_db()
+        self.assertEqual((self.second.date, int(self.second.km)), (date(2019, 1, 12), 550))
+
+    def test_create_record_view(self):
+        url = reverse('myequis:create_record', args=(self.bicycle.id,))
+        response = self.client.post(url, {'id': '', 'date': '2019-01-10', 'km': 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Record.objects.filter(bicycle=self.bicycle).count(), 2)
+
+        response = self.client.post(url, {'id': '', 'date': '2019-01-11', 'km': 600})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Record.objects.filter(bicycle=self.bicycle).count(), 3)
+
+
+class ImportRecordsTests(TestCase):
+
+    def setUp(self):
+        self.bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=self.bicycle, date=date(2019, 1, 10), km=500)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Imports the lines, returns the output and the reported errors
+    def run_import(self, name, lines, *args):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write("\n".join(lines) + "\n")
+        out, err = StringIO(), StringIO()
+        call_command('import_records', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_dry_run(self):
+        out, err = self.run_import('records.csv', ["bicycle,date,km", "Road,2019-01-01,100", "Road,2019-01-11,600"],
+                                   '--dry-run')
+        self.assertIn("2 records valid", out)
+        self.assertEqual(Record.objects.count(), 1)
+
+    def test_invalid_rows(self):
+        lines = [
+            "bicycle,date,km",
+            "Road,2019-01-05,600",
+            "Road,2019-01-11,600",
+            "Road,2019-01-03,100",
+            "Road,2019-01-12,400",
+        ]
+        with self.assertRaises(CommandError):
+            self.run_import('records.csv', lines)
+        self.assertEqual(Record.objects.count(), 1)
+
+        out, err = self.run_import('records.csv', lines, '--skip-invalid')
+        self.assertIn("line 2: 600 > 500 km", err)
+        self.assertIn("line 4: File is not sorted by date", err)
+        self.assertIn("line 5: 400 < 600 km", err)
+        self.assertEqual(list(Record.objects.order_by('date').values_list('km', flat=True)), [500, 600])
+
+    def test_ndjson(self):
+        out, err = self.run_import('records.ndjson', [
+            json.dumps({'bicycle': self.bicycle.id, 'date': "2019-01-11", 'km': 600}),
+            "[1, 2]",
+        ], '--skip-invalid')
+        self.assertIn("line 2: Not an object", err)
+        self.assertIn("1 records imported", out)
+
+
+# The summaries are refreshed on commit, so the changes must really be committed
+class BicycleSummaryTests(TransactionTestCase):
+
+    def test_follows_changes(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        part = Part.objects.create(name="Chain", component=Component.objects.create(name="Drive"))
+        first = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        last = Record.objects.create(bicycle=bicycle, date=date(2019, 2, 1), km=300)
+        chain = Material.objects.create(name="Chain", manufactor="M", part=part, price=20, mount_record=first,
+                                        **{'Weight [g]': 250})
+
+        bicycle.summary.refresh_from_db()
+        self.assertEqual(bicycle.summary.km, 300)
+        self.assertEqual(bicycle.summary.record_count, 2)
+        self.assertEqual(bicycle.summary.first_date, date(2019, 1, 1))
+        self.assertEqual(bicycle.summary.mounted_count, 1)
+        self.assertEqual(bicycle.summary.material_cost, 20)
+        self.assertEqual(bicycle.summary.mounted_weight, 250)
+        self.assertEqual(bicycle.summary.mounted_cost, 20)
+        self.assertEqual(summary.components(bicycle.id), [{'component': "Drive", 'count': 1, 'weight': 250, 'cost': 20}])
+        self.assertEqual(Material.objects.with_cost_per_km().get().cost_per_km, 0.1)
+
+        chain.dismount_record = last
+        chain.save()
+        last.delete()
+
+        bicycle.summary.refresh_from_db()
+        self.assertEqual(bicycle.summary.km, 100)
+        self.assertEqual(bicycle.summary.record_count, 1)
+        self.assertEqual(bicycle.summary.mounted_count, 0)
+        self.assertEqual(bicycle.summary.material_cost, 0)
+        self.assertEqual(bicycle.summary.mounted_weight, 0)
+        self.assertEqual(summary.verify(), [])
+
+    def test_applies_deltas(self):
+        road = Bicycle.objects.create(name="Road")
+        gravel = Bicycle.objects.create(name="Gravel")
+        first = Record.objects.create(bicycle=road, date=date(2019, 1, 1), km=100)
+        middle = Record.objects.create(bicycle=road, date=date(2019, 1, 15), km=200)
+        last = Record.objects.create(bicycle=road, date=date(2019, 2, 1), km=300)
+        chain = Material.objects.create(name="Chain", manufactor="M", price=20, mount_record=middle,
+                                        **{'Weight [g]': 250})
+        tire = Material.objects.create(name="Tire", manufactor="M", price=30, mount_record=first,
+                                       dismount_record=middle)
+
+        def change(step):
+            # no aggregation over the history
+            with CaptureQueriesContext(connection) as queries:
+                step()
+            self.assertFalse([query for query in queries
+                              if 'COUNT(' in query['sql'] and 'FROM "myequis_record"' in query['sql']])
+            self.assertEqual(summary.verify(), [])
+
+        change(lambda: Record.objects.create(bicycle=road, date=date(2019, 2, 10), km=350))
+        change(lambda: Record.objects.create(bicycle=road, date=date(2018, 12, 1), km=50))
+        last.km = 320
+        change(last.save)
+        middle.bicycle = gravel
+        change(middle.save)
+        chain.price = 25
+        change(chain.save)
+        chain.dismount_record = last
+        change(chain.save)
+        change(tire.delete)
+        change(first.delete)
+
+
+class CachingTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_invalidated_by_changes(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        url = reverse('myequis:records', args=(bicycle.id,))
+
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(caching.stats(), {'hits': 1, 'misses': 2})
+
+        record = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=1234)
+        self.assertContains(self.client.get(url), "1234")
+
+        record.km = 4321
+        record.save()
+        self.assertContains(self.client.get(url), "4321")
+
+        record.delete()
+        self.assertContains(self.client.get(url), "No records yet")
+
+    def test_invalid_cursor(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        url = reverse('myequis:records', args=(bicycle.id,))
+
+        self.client.get(url)
+        # the same page as without cursor
+        self.client.get(url, {'after': "garbage x"})
+        self.assertEqual(caching.stats(), {'hits': 1, 'misses': 2})
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_dummy_cache(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=1234)
+
+        self.assertContains(self.client.get(reverse('myequis:index')), "Road")
+        self.assertContains(self.client.get(reverse('myequis:records', args=(bicycle.id,))), "1234")
+
+
+class ConditionalTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    # Status of a GET with the ETag of the previous one
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_not_modified(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        urls = [
+            reverse('myequis:index'),
+            reverse('myequis:bicycle', args=(bicycle.id,)),
+            reverse('myequis:records', args=(bicycle.id,)),
+        ]
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, etags[url]), 304)
+
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url, etags[url]), 200)
+
+        # the index shows the unused materials
+        etag = self.client.get(urls[0])['ETag']
+        Material.objects.create(name="Chain", manufactor="KMC")
+        self.assertEqual(self.revalidate(urls[0], etag), 200)
+
+    def test_index_without_query(self):
+        url = reverse('myequis:index')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(url, etag), 304)
+
+
+class MaterialSearchTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        search.index.clear()
+
+    def test_follows_changes(self):
+        part = Part.objects.create(name="Tire", component=Component.objects.create(name="Rear Wheel"))
+        tire = Material.objects.create(name="Grand Prix 5000", manufactor="Continental", part=part)
+        Material.objects.create(name="Marathon", manufactor="Schwalbe")
+
+        self.assertEqual(search.search("prix"), [tire])
+        self.assertEqual(search.search("contnental"), [tire])
+        self.assertEqual(search.search("rear wheel/tire"), [tire])
+
+        part.name = "Tubeless Tire"
+        part.save()
+        self.assertEqual(search.search("tubeless"), [tire])
+
+        tire.delete()
+        self.assertEqual(search.search("prix"), [])
+
+        response = self.client.get(reverse('myequis:search_materials'), {'q': "marath", 'format': 'json'})
+        self.assertEqual([material['name'] for material in response.json()['materials']], ["Marathon"])
+
+    def test_warm_on_first_request(self):
+        Material.objects.create(name="Marathon", manufactor="Schwalbe")
+        request_started.connect(search.warm_on_first_request)
+        self.client.get(reverse('myequis:index'))
+        self.client.get(reverse('myequis:index'))
+
+        # started once
+        self.assertFalse(request_started.disconnect(search.warm_on_first_request))
+        # waits for the background build
+        search.warm()
+        self.assertEqual(len(search.index.texts), 1)
+
+
+class ConfigurationTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        configuration.index.clear()
+
+    def test_mounted_materials(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        part = Part.objects.create(name="Chain", component=Component.objects.create(name="Drivetrain"))
+        first = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        second = Record.objects.create(bicycle=bicycle, date=date(2019, 6, 1), km=2000)
+        old = Material.objects.create(name="Old", manufactor="KMC", part=part,
+                                      mount_record=first, dismount_record=second)
+        new = Material.objects.create(name="New", manufactor="KMC", part=part, mount_record=second)
+
+        self.assertEqual(configuration.mounted_at(bicycle.id, date(2018, 12, 31)), [])
+        self.assertEqual(configuration.mounted_at(bicycle.id, date(2019, 5, 31)), [old])
+        self.assertEqual(configuration.mounted_at(bicycle.id, date(2019, 6, 1)), [new])
+        self.assertEqual(configuration.mounted_during(bicycle.id, date(2019, 5, 1), date(2019, 7, 1)), [old, new])
+        self.assertEqual(configuration.changes(bicycle.id, date(2019, 2, 1), date(2019, 7, 1)), [(part, [old], [new])])
+
+        # kept while no mount or dismount date changes
+        intervals = configuration.index.intervals(bicycle.id)
+        Record.objects.create(bicycle=bicycle, date=date(2019, 7, 1), km=2500)
+        second.km = 2100
+        second.save()
+        self.assertIs(configuration.index.intervals(bicycle.id), intervals)
+
+        second.date = date(2019, 5, 1)
+        second.save()
+        self.assertEqual(configuration.mounted_at(bicycle.id, date(2019, 5, 15)), [new])
+
+
+class MaterialStateTests(TestCase):
+
+    def test_mount_and_dismount(self):
+        road = Bicycle.objects.create(name="Road")
+        gravel = Bicycle.objects.create(name="Gravel")
+        part = Part.objects.create(name="Chain", component=Component.objects.create(name="Drivetrain"))
+        first = Record.objects.create(bicycle=road, date=date(2019, 1, 1), km=100)
+        old = Material.objects.create(name="Old", manufactor="KMC", part=part, mount_record=first)
+        new = Material.objects.create(name="New", manufactor="KMC", part=part)
+        self.assertEqual((old.state, old.bicycle_id), (Material.MOUNTED, road.id))
+        self.assertEqual((new.state, new.bicycle_id), (Material.NEW, None))
+
+        services.swap_materials(road.id, date(2019, 6, 1), 2000, mount=[new.id])
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual((old.state, old.bicycle_id), (Material.DISMOUNTED, None))
+        self.assertEqual((new.state, new.bicycle_id), (Material.MOUNTED, road.id))
+        self.assertIsNone(old.mounted_in_bicycle())
+        self.assertEqual(new.mounted_in_bicycle(), "Road")
+
+        new.mount_record.bicycle = gravel
+        new.mount_record.save()
+        self.assertEqual(list(gravel.mounted_materials.all()), [new])
+
+    def test_swap_at_existing_record(self):
+        road = Bicycle.objects.create(name="Road")
+        part = Part.objects.create(name="Chain", component=Component.objects.create(name="Drivetrain"))
+        Record.objects.create(bicycle=road, date=date(2019, 6, 1), km=2000)
+        new = Material.objects.create(name="New", manufactor="KMC", part=part)
+        url = reverse('myequis:swap', args=(road.id,))
+
+        # the existing record's km are not overwritten
+        response = self.client.post(url, {'date': '2019-06-01', 'km': 2500, 'mount': [new.id]})
+        self.assertContains(response, "The record of 2019-06-01 has 2000 km")
+        new.refresh_from_db()
+        self.assertEqual(new.state, Material.NEW)
+
+        response = self.client.post(url, {'date': '2019-06-01', 'km': 2000, 'mount': [new.id]})
+        self.assertEqual(response.status_code, 302)
+        new.refresh_from_db()
+        self.assertEqual(new.state, Material.MOUNTED)
+
+
+class OdometerTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        odometer.index.clear()
+
+    def test_interpolation(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        record = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 11), km=600)
+
+        self.assertEqual(odometer.kms_at(bicycle.id, [date(2018, 12, 31), date(2019, 1, 1), date(2019, 1, 3),
+                                                      date(2019, 1, 11), date(2019, 2, 1)]),
+                         [None, 100, 200, 600, 600])
+        self.assertEqual(odometer.dates_at(bicycle.id, [0, 100, 120, 150, 600, 601]),
+                         [date(2019, 1, 1), date(2019, 1, 1), date(2019, 1, 2), date(2019, 1, 2),
+                          date(2019, 1, 11), None])
+
+        record.km = 1100
+        record.save()
+        self.assertEqual(odometer.km_at(bicycle.id, date(2019, 1, 3)), 300)
+
+
+@skipUnless(forecast.available(), "NumPy is not installed")
+class ForecastTests(TestCase):
+
+    def test_due_dates(self):
+        road = Bicycle.objects.create(name="Road")
+        # long before the fitted days
+        Record.objects.create(bicycle=road, date=date(2018, 1, 1), km=0)
+        records = [Record.objects.create(bicycle=road, date=date(2019, 1, 1) + timedelta(days=i), km=1000 + 10 * i)
+                   for i in range(21)]
+        chain = Material.objects.create(name="Chain", manufactor="KMC", wear_limit=500, mount_record=records[0])
+
+        retired = Bicycle.objects.create(name="Retired")
+        first = Record.objects.create(bicycle=retired, date=date(2015, 1, 1), km=0)
+        Record.objects.create(bicycle=retired, date=date(2015, 1, 11), km=50)
+        tire = Material.objects.create(name="Tire", manufactor="Conti", wear_limit=100, mount_record=first)
+        Material.objects.create(name="Spare", manufactor="Conti", wear_limit=100)
+
+        summary.refresh(road.id)
+        summary.refresh(retired.id)
+
+        wears = forecast.forecast()
+        self.assertEqual([wear.material for wear in wears], [tire, chain])
+        self.assertAlmostEqual(wears[0].km_per_day, 5)
+        self.assertEqual(wears[0].due, date(2015, 1, 21))
+        self.assertAlmostEqual(wears[1].km_per_day, 10)
+        self.assertEqual(wears[1].mileage, 200)
+        self.assertEqual(wears[1].due, date(2019, 2, 20))
+
+
+class TreeTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        tree.index.clear()
+
+    def test_mounted_per_part(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        drivetrain = Component.objects.create(name="Drivetrain")
+        chain = Part.objects.create(name="Chain", component=drivetrain)
+        Part.objects.create(name="Cassette", component=drivetrain)
+        record = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        material = Material.objects.create(name="X11", manufactor="KMC", part=chain, mount_record=record)
+        Material.objects.create(name="Spare", manufactor="KMC", part=chain)
+
+        result = tree.tree(bicycle.id)
+        self.assertEqual([(part.name, part.materials) for component in result.components for part in component.parts],
+                         [("Cassette", []), ("Chain", [material])])
+
+        # the hierarchy is kept
+        with self.assertNumQueries(1):
+            tree.tree(bicycle.id)
+
+        Part.objects.create(name="Crank", component=drivetrain)
+        self.assertEqual([part.name for part in tree.tree(bicycle.id).components[0].parts],
+                         ["Cassette", "Chain", "Crank"])
+
+    def test_page_etag(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        url = reverse('myequis:bicycle', args=(bicycle.id,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Part.objects.create(name="Chain", component=Component.objects.create(name="Drivetrain"))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DistanceTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_per_period(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        month = timezone.localdate().replace(day=1)
+        before = (month - timedelta(days=1)).replace(day=1)
+        old = Record.objects.create(bicycle=bicycle, date=before - timedelta(days=40), km=100)
+        Record.objects.create(bicycle=bicycle, date=before, km=300)
+        current = Record.objects.create(bicycle=bicycle, date=month, km=1000)
+
+        history = (before - timedelta(days=40)).replace(day=1)
+        self.assertEqual(distances.per_period('month', bicycle.id)[0], (history, 0))
+        self.assertEqual(distances.per_period('month', bicycle.id)[-2:], [(before, 200), (month, 700)])
+
+        # only the current month is computed again
+        current.km = 1500
+        current.save()
+        self.assertEqual(caching.stats()['misses'], 1)
+        self.assertEqual(distances.per_period('month', bicycle.id)[-1], (month, 1200))
+        self.assertEqual(caching.stats()['misses'], 1)
+
+        old.km = 200
+        old.save()
+        self.assertEqual(distances.per_period('month', bicycle.id)[-2], (before, 100))
+        self.assertEqual(caching.stats()['misses'], 2)
+        self.assertEqual(sum(km for start, km in distances.per_period('year')), 1300)
+
+    def test_string_date(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date="2019-01-01", km=5)
+        self.assertEqual(distances.per_period('year', bicycle.id, today=date(2019, 6, 1)), [(date(2019, 1, 1), 0)])
+
+
+class SyncTests(TestCase):
+
+    def test_changes_since_cursor(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        record = Record.objects.create(bicycle=bicycle, date=date(2019, 2, 1), km=300)
+
+        url = reverse('myequis:sync')
+        first = self.client.get(url, {'limit': 2}).json()
+        self.assertTrue(first['more'])
+        second = self.client.get(url, {'cursor': first['cursor'], 'limit': 2}).json()
+        self.assertFalse(second['more'])
+        rows = first['changes'].get('record', []) + second['changes'].get('record', [])
+        self.assertEqual(sorted(row[0] for row in rows), sorted(Record.objects.values_list('id', flat=True)))
+
+        id = record.id
+        record.delete()
+        changes = sync.changes(second['cursor'])
+        self.assertEqual(changes['deleted'], {'record': [id]})
+        self.assertEqual(self.client.get(url, {'cursor': "yesterday"}).status_code, 400)
+
+
+class BicycleDeleteTests(TestCase):
+
+    # Queries to delete a bicycle with n records and a material
+    def delete(self, n):
+        bicycle = Bicycle.objects.create(name="Road")
+        records = [Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1) + timedelta(days=i), km=i)
+                   for i in range(n)]
+        material = Material.objects.create(name="Chain", manufactor="KMC", mount_record=records[0])
+
+        with CaptureQueriesContext(connection) as context:
+            bicycle.delete()
+
+        self.assertEqual(Tombstone.objects.filter(model='record', object_id__in=[r.id for r in records]).count(), n)
+        self.assertTrue(Tombstone.objects.filter(model='material', object_id=material.id).exists())
+        self.assertTrue(Tombstone.objects.filter(model='bicycle').exists())
+        return len(context)
+
+    def test_cascade_in_bulk(self):
+        self.assertEqual(self.delete(5), self.delete(50))
+
+
+class SyncRestampTests(TransactionTestCase):
+
+    def test_restamped_on_commit(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        with transaction.atomic():
+            record = Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+            sync.restamp_on_commit(Record.objects.filter(id=record.id))
+            written = timezone.now()
+
+        record.refresh_from_db()
+        self.assertGreater(record.modified, written)
+
+
+@override_settings(MYEQUIS_INGEST_TOKENS=['secret'])
+class IngestTests(TestCase):
+
+    def post(self, readings, token='secret'):
+        return self.client.post(reverse('myequis:ingest'), json.dumps({'readings': readings}),
+                                content_type='application/json', HTTP_AUTHORIZATION='Token ' + token)
+
+    def test_coalesced_per_day(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1), km=100)
+        Record.objects.create(bicycle=bicycle, date=date(2019, 1, 5), km=500)
+
+        self.assertEqual(self.post([], token='wrong').status_code, 401)
+
+        response = self.post([
+            {'bicycle': bicycle.id, 'date': "2019-01-03T08:00:00", 'km': 200},
+            {'bicycle': bicycle.id, 'date': "2019-01-03T18:00:00", 'km': 250},
+            {'bicycle': bicycle.id, 'date': "2019-01-05", 'km': 550},
+            {'bicycle': bicycle.id, 'date': "2019-01-04", 'km': 50},
+            {'bicycle': bicycle.id + 1, 'date': "2019-01-04", 'km': 50},
+            {'bicycle': bicycle.id, 'km': 50},
+        ])
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [3, 4, 5])
+        self.assertEqual(list(Record.objects.filter(bicycle=bicycle).order_by('date').values_list('km', flat=True)),
+                         [100, 250, 550])
+
+
+GPX = b"""<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+<trk><name>Ride</name><trkseg>
+<trkpt lat="48.0" lon="11.0"><time>2019-08-01T08:00:00Z</time></trkpt>
+<trkpt lat="48.1" lon="11.0"><time>2019-08-01T08:30:00Z</time></trkpt>
+</trkseg><trkseg>
+<trkpt lat="48.1" lon="11.0"></trkpt>
+<trkpt lat="48.2" lon="11.0"></trkpt>
+</trkseg></trk>
+</gpx>"""
+
+
+@skipUnless(gpx.available(), "requires NumPy")
+class GpxTests(TestCase):
+
+    def test_import(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        Record.objects.create(bicycle=bicycle, date=date(2019, 7, 1), km=100)
+
+        rides = gpx.read(BytesIO(GPX))
+        self.assertEqual(len(rides), 1)
+        self.assertEqual(rides[0].date, date(2019, 8, 1))
+        self.assertAlmostEqual(rides[0].km, 22.24, places=2)
+
+        upload = SimpleUploadedFile("ride.gpx", GPX)
+        self.client.post(reverse('myequis:import_gpx', args=(bicycle.id,)), {'files': upload})
+        self.assertEqual(Record.objects.get(bicycle=bicycle, date=date(2019, 8, 1)).km, 122)
+
+        # not counted twice
+        self.assertEqual(gpx.append(bicycle.id, [(ride.date, ride.km) for ride in rides]), [])
+
+    def test_point_without_coordinates(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        invalid = GPX.replace(b'<trkpt lat="48.2" lon="11.0">', b'<trkpt lat="48.2">')
+        with self.assertRaises(ValueError):
+            gpx.read(BytesIO(invalid))
+
+        upload = SimpleUploadedFile("ride.gpx", invalid)
+        response = self.client.post(reverse('myequis:import_gpx', args=(bicycle.id,)), {'files': upload})
+        self.assertContains(response, "ride.gpx: Track point without lat or lon")
+
+        with tempfile.NamedTemporaryFile(suffix='.gpx') as file:
+            file.write(invalid)
+            file.flush()
+            self.assertEqual(gpx.read_path(file.name)[1:], ([], "Track point without lat or lon"))
+
+
+class CompactionTests(TestCase):
+
+    def test_keeps_period_ends_and_references(self):
+        bicycle = Bicycle.objects.create(name="Road")
+        records = [Record.objects.create(bicycle=bicycle, date=date(2019, 1, 1) + timedelta(days=day), km=day * 10)
+                   for day in range(70)]
+        Material.objects.create(name="Chain", manufactor="KMC", mount_record=records[10])
+
+        # monthly in January, weekly in February, daily since March
+        deleted = compaction.compact(weekly_after=30, monthly_after=58, today=date(2019, 3, 31))
+        # kept: January 1, 11 and 31, the ends of the ISO weeks in February and February 28
+        self.assertEqual(deleted, {bicycle.id: 31 - 3 + 28 - 5})
+
+        kept = set(Record.objects.values_list('date', flat=True))
+        for day in [date(2019, 1, 1), date(2019, 1, 11), date(2019, 1, 31), date(2019, 2, 3), date(2019, 2, 28),
+                    date(2019, 3, 1), date(2019, 3, 11)]:
+            self.assertIn(day, kept)
+        self.assertEqual(Tombstone.objects.count(), deleted[bicycle.id])
+
+
+class InstrumentationTests(TestCase):
+
+    @override_settings(MYEQUIS_INSTRUMENTATION=True)
+    @modify_settings(MIDDLEWARE={'append': 'myequis.instrumentation.InstrumentationMiddleware'})
+    def test_measures_requests(self):
+        instrumentation.reset()
+        instrumentation.install()
+        render = DjangoTemplate.render
+        # wrapped only once
+        instrumentation.install()
+        self.assertIs(DjangoTemplate.render, render)
+
+        response = self.client.get(reverse('myequis:index'))
+        self.assertIn('X-Query-Count', response)
+        self.assertIn('render;dur=', response['Server-Timing'])
+        self.assertEqual([row['name'] for row in instrumentation.report()], ['index'])
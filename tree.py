@@ -0,0 +1,90 @@
+import threading
+
+from myequis import caching
+from myequis.models import Component
+from myequis.models import Material
+from myequis.models import Part
+
+
+# Component/part tree of a bicycle with the materials mounted on each part now.
+#
+# The hierarchy of the components and their parts is the same for every bicycle and rarely
+# changes, so it is kept in process. It is reloaded after the catalog's cache scope got
+# invalidated, i.e. after a component or part was saved or deleted (see signals.py).
+# The materials mounted on the bicycle are one query on the partial index of the mounted
+# materials, so a tree takes one query, three when the hierarchy is reloaded.
+
+
+class PartNode:
+
+    def __init__(self, id, name, materials):
+        self.id = id
+        self.name = name
+        # Materials mounted on the part now, usually one
+        self.materials = materials
+
+
+class ComponentNode:
+
+    def __init__(self, id, name, parts):
+        self.id = id
+        self.name = name
+        self.parts = parts
+
+    # Number of the component's materials mounted now
+    def mounted_count(self):
+        return sum(len(part.materials) for part in self.parts)
+
+
+class Tree:
+
+    def __init__(self, components, unassigned):
+        self.components = components
+        # Materials mounted without part
+        self.unassigned = unassigned
+
+
+class CatalogIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.versions = None
+        # (component id, name, [(part id, name)]) ordered by names
+        self.components = []
+
+    def hierarchy(self):
+        versions = caching.versions('all', 'catalog')
+
+        with self.lock:
+            if versions == self.versions and None not in versions:
+                return self.components
+
+        parts = {}
+        for id, component_id, name in Part.objects.select_related(None).order_by('name').values_list(
+                'id', 'component_id', 'name'):
+            parts.setdefault(component_id, []).append((id, name))
+        components = [(id, name, parts.get(id, []))
+                      for id, name in Component.objects.order_by('name').values_list('id', 'name')]
+
+        with self.lock:
+            self.versions = versions
+            self.components = components
+        return components
+
+
+index = CatalogIndex()
+
+
+def tree(bicycle_id):
+    mounted = {}
+    for material in Material.objects.filter(bicycle_id=bicycle_id, state=Material.MOUNTED).order_by('name'):
+        mounted.setdefault(material.part_id, []).append(material)
+
+    components = [
+        ComponentNode(id, name, [PartNode(part_id, part_name, mounted.get(part_id, []))
+                                 for part_id, part_name in parts])
+        for id, name, parts in index.hierarchy()]
+    return Tree(components, mounted.get(None, []))
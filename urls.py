@@ -14,9 +14,28 @@ urlpatterns = [
     # ex: myequis/bicycles/5/records
     path('bicycles/<int:bicycle_id>/records', views.records, name='records'),
 
+    # ex: myequis/bicycles/5/records/export?format=ndjson
+    path('bicycles/<int:bicycle_id>/records/export', views.export_records, name='export_records'),
+
     # ex: myequis/bicycles/5/create_record
     path('bicycles/<int:bicycle_id>/create_record', views.create_record, name='create_record'),
     
+    # Mount and dismount several materials at once
+    # ex: myequis/bicycles/5/swap
+    path('bicycles/<int:bicycle_id>/swap', views.swap, name='swap'),
+    
+    # km per month or year as JSON
+    # ex: myequis/bicycles/5/distances?period=year
+    path('bicycles/<int:bicycle_id>/distances', views.distance_statistics, name='distances'),
+    
+    # Upload GPX files
+    # ex: myequis/bicycles/5/gpx
+    path('bicycles/<int:bicycle_id>/gpx', views.import_gpx, name='import_gpx'),
+    
+    # Mounted materials at a date
+    # ex: myequis/bicycles/5/configuration?date=2019-08-01
+    path('bicycles/<int:bicycle_id>/configuration', views.bicycle_configuration, name='configuration'),
+    
     # Update record
     # ex: myequis/records/4
     #path('records/<int:record_id>/', views.record, name='record'),
@@ -25,6 +44,31 @@ urlpatterns = [
     # ex: myequis/materials/5/
     path('<int:material_id>/', views.material, name='material'),
     
+    # ex: myequis/materials/search?q=conti
+    path('materials/search', views.search_materials, name='search_materials'),
+    
+    # ex: myequis/materials/export?format=csv
+    path('materials/export', views.export_materials, name='export_materials'),
+    
+    # km per month or year of all bicycles as JSON
+    # ex: myequis/distances?period=year
+    path('distances', views.distance_statistics, name='fleet_distances'),
+    
+    # ex: myequis/forecast/
+    path('forecast/', views.wear_forecast, name='forecast'),
+    
+    # staff only
+    # ex: myequis/instrumentation/
+    path('instrumentation/', views.instrumentation_report, name='instrumentation'),
+    
+    # Odometer readings as JSON, POST only
+    # ex: myequis/readings
+    path('readings', views.ingest_readings, name='ingest'),
+    
+    # Delta sync for offline clients
+    # ex: myequis/sync?cursor=2019-08-01T10:00:00.000000Z_3_1234
+    path('sync', views.sync_changes, name='sync'),
+    
     # ex: myequis/newmaterials/
     path('newmaterials/', views.newmaterials, name='newmaterials'),
     ]
@@ -1,19 +1,48 @@
+from django import forms
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect
+from django.http import JsonResponse
 from django.template import loader
 from myequis.models import Material
 from myequis.models import Bicycle
+from myequis.models import BicycleSummary
 from myequis.models import Record
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
-from .forms import RecordForm
+from .forms import ConfigurationForm, GpxForm, RecordForm, SwapForm
+from . import services
+from .pagination import PAGE_SIZE, normalize_cursor, records_page
+from . import caching
+from . import configuration
+from . import distances
+from . import export
+from . import forecast
+from . import gpx
+from . import ingest
+from . import instrumentation
+from . import odometer
+from . import search
+from . import summary
+from . import sync
+from . import tree
+from .conditional import bicycle_etag, bicycle_page_etag, index_etag
 from django.views.generic.edit import UpdateView
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import etag, require_POST
+from django.contrib.admin.views.decorators import staff_member_required
+from django.conf import settings
+from django.utils import timezone
+import json
 import logging
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# Number of latest records shown on the bicycle page
+BICYCLE_RECORDS = 10
+
 class UpdateRecordView(UpdateView):
     
     def get(self, request, *args, **kwargs):
@@ -30,16 +59,12 @@ class UpdateRecordView(UpdateView):
     def post(self, request, *args, **kwargs):
         record = get_object_or_404(Record, pk=kwargs['record_id'])
         
-        logger.warning("LOGGER: " + str(record))
         form = RecordForm(request.POST)
         
-        
-        form.enable_validations()
-        
-        logger.warning(str(record))
+        # checks the neighbour records while validating
+        form.enable_validations(record.bicycle_id, record_id=record.id)
         
         if form.is_valid():
-            form.check_edit_record()
             # process the data in form.cleaned_data as required
             record.date = form.cleaned_data['date']
             record.km = form.cleaned_data['km']
@@ -68,6 +93,7 @@ def create_record(request, bicycle_id):
     if request.method == 'POST':
         # create a form instance and populate it with data from the request:
         form = RecordForm(request.POST)
+        form.enable_validations(bicycle_id)
         # check whether it's valid:
         if form.is_valid():
             # process the data in form.cleaned_data as required
@@ -88,56 +114,120 @@ def create_record(request, bicycle_id):
     return HttpResponse(template.render({ 'record': record, 'form': form }, request))
 
 
+# Latest records of the bicycle, page after cursor. Cached with the records table.
+def cached_records_page(bicycle_id, cursor, size):
+    return caching.cached(
+        [caching.bicycle_scope(bicycle_id)], "records:{}:{}".format(size, cursor),
+        lambda: records_page(Record.objects.filter(bicycle__id=bicycle_id), cursor, size))
+
+
+def records_table(bicycle_id, cursor=None, size=PAGE_SIZE, links=True):
+    def render():
+        records, next_cursor = cached_records_page(bicycle_id, cursor, size)
+        return loader.get_template('myequis/records_table.html').render({
+            'bicycle_id': bicycle_id,
+            'records': records,
+            'cursor': cursor,
+            'next_cursor': next_cursor,
+            'links': links,
+        })
+
+    return caching.cached(
+        [caching.bicycle_scope(bicycle_id)], "records-table:{}:{}:{}".format(size, cursor, links), render)
+
+
+@etag(bicycle_etag)
 def records(request, bicycle_id):
-    records = Record.objects.filter(bicycle__id=bicycle_id).order_by('-date')
+    # the cursor is part of the cache keys
+    cursor = normalize_cursor(request.GET.get('after'))
 
     bicycle = Bicycle.objects.get(pk=bicycle_id)
     template = loader.get_template('myequis/records.html')
 
     context = {
         'bicycle': bicycle,
-        'records': records
+        'records_table': records_table(bicycle_id, cursor),
     }
     
     return HttpResponse(template.render(context, request))
 
+@etag(bicycle_page_etag)
 def bicycle(request, bicycle_id):
     
     bicycle = Bicycle.objects.get(pk=bicycle_id)
-    records = Record.objects.filter(bicycle__id=bicycle_id).order_by('-date')
     
     template = loader.get_template('myequis/bicycle.html')
 
     context = {
         'bicycle': bicycle,
-        'records': records
+        # only the latest ones, the others are on the records pages
+        'records_table': records_table(bicycle_id, size=BICYCLE_RECORDS, links=False),
+        'mounted_table': mounted_table(bicycle_id),
+        'tree_table': tree_table(bicycle_id),
     }
     
     return HttpResponse(template.render(context, request))
 
+# Components and parts with the materials mounted on them now
+def tree_table(bicycle_id):
+    def render():
+        return loader.get_template('myequis/tree.html').render({
+            'tree': tree.tree(bicycle_id),
+        })
+
+    return caching.cached([caching.bicycle_scope(bicycle_id), 'catalog'], 'tree-table', render)
+
+# Weight and cost of the mounted materials, per component and per material
+def mounted_table(bicycle_id):
+    def render():
+        return loader.get_template('myequis/mounted_table.html').render({
+            'summary': BicycleSummary.objects.filter(bicycle_id=bicycle_id).first(),
+            'components': summary.components(bicycle_id),
+            'materials': Material.objects.filter(bicycle_id=bicycle_id, state=Material.MOUNTED)
+                .with_related().with_cost_per_km().order_by('part__component__name', 'part__name'),
+        })
+
+    return caching.cached([caching.bicycle_scope(bicycle_id)], 'mounted-table', render)
+
+def bicycles_table():
+    def render():
+        return loader.get_template('myequis/bicycles_table.html').render({
+            'bicycles': Bicycle.objects.select_related('summary').order_by('name'),
+            'fleet': summary.fleet(),
+        })
+
+    return caching.cached(['fleet'], 'bicycles-table', render)
+
+def materials_table():
+    def render():
+        return loader.get_template('myequis/materials_table.html').render({
+            'materials': Material.objects.filter(state=Material.NEW).order_by('name'),
+        })
+
+    return caching.cached(['materials'], 'materials-table', render)
+
+@etag(index_etag)
 def index(request):
     
-    bicycles = Bicycle.objects.order_by('name')
-    
-    materials = Material.objects.filter(mount_record=None).order_by('name')
-    #.order_by('name')
-    
     template = loader.get_template('myequis/index.html')
     context = {
-        'bicycles': bicycles,
-        'materials': materials
+        'bicycles_table': bicycles_table(),
+        'materials_table': materials_table(),
     }
     
     return HttpResponse(template.render(context, request))
 
 def newmaterials(request):
-    new_material_list = Material.objects.filter(mount_record=None)
-    template = loader.get_template('myequis/newmaterials.html')
-    context = {
-            'new_material_list': new_material_list,
-        }
+    def render():
+        new_material_list = Material.objects.filter(state=Material.NEW).with_related()
+        template = loader.get_template('myequis/newmaterials.html')
+        context = {
+                'new_material_list': new_material_list,
+            }
+        return template.render(context)
     
-    return HttpResponse(template.render(context, request))
+    # shows the parts too
+    return HttpResponse(caching.cached(['materials', 'catalog'], 'newmaterials', render))
 
 def material(request, material_id):
     
@@ -146,3 +236,190 @@ def material(request, material_id):
     return HttpResponse("You're looking at material %s." % material.name)
 
     
+
+
+# ex: ?format=ndjson, default is CSV
+def export_records(request, bicycle_id):
+    bicycle = get_object_or_404(Bicycle, pk=bicycle_id)
+    
+    return export.stream(export.RECORD_FIELDS, export.record_rows(bicycle.id),
+                         request.GET.get('format'), "records-{}".format(bicycle.id))
+
+def export_materials(request):
+    
+    return export.stream(export.MATERIAL_FIELDS, export.material_rows(),
+                         request.GET.get('format'), "materials")
+
+def wear_forecast(request):
+    
+    template = loader.get_template('myequis/forecast.html')
+    context = {
+        'available': forecast.available(),
+        'wears': forecast.forecast() if forecast.available() else [],
+    }
+    
+    return HttpResponse(template.render(context, request))
+
+@staff_member_required
+def instrumentation_report(request):
+    
+    template = loader.get_template('myequis/instrumentation.html')
+    context = {
+        'enabled': getattr(settings, 'MYEQUIS_INSTRUMENTATION', False),
+        'rows': instrumentation.report(),
+        'cache': caching.stats(),
+    }
+    
+    return HttpResponse(template.render(context, request))
+
+def swap(request, bicycle_id):
+    
+    bicycle = get_object_or_404(Bicycle, pk=bicycle_id)
+    
+    if request.method == 'POST':
+        form = SwapForm(request.POST)
+        if form.is_valid():
+            try:
+                services.swap_materials(
+                    bicycle.id, form.cleaned_data['date'], form.cleaned_data['km'],
+                    mount=[material.id for material in form.cleaned_data['mount']],
+                    dismount_parts=[part.id for part in form.cleaned_data['dismount']])
+                
+                return HttpResponseRedirect(reverse('myequis:bicycle', args=(bicycle.id,)))
+            except forms.ValidationError as e:
+                form.add_error(None, e)
+    else:
+        form = SwapForm()
+    
+    template = loader.get_template('myequis/swap.html')
+    return HttpResponse(template.render({ 'bicycle': bicycle, 'form': form }, request))
+
+# km per month or year (period=year) of a bicycle or of all bicycles, as JSON
+# ex: ?period=year
+def distance_statistics(request, bicycle_id=None):
+    if bicycle_id is not None:
+        get_object_or_404(Bicycle, pk=bicycle_id)
+    
+    period = request.GET.get('period')
+    if period not in distances.PERIODS:
+        period = 'month'
+    
+    return JsonResponse({
+        'period': period,
+        'distances': [{ 'start': start, 'km': km } for start, km in distances.per_period(period, bicycle_id)],
+    })
+
+# Appends the rides of uploaded GPX files as records
+def import_gpx(request, bicycle_id):
+    
+    bicycle = get_object_or_404(Bicycle, pk=bicycle_id)
+    
+    if request.method == 'POST':
+        form = GpxForm(request.POST, request.FILES)
+        if form.is_valid() and gpx.available():
+            rides = []
+            for file in request.FILES.getlist('files'):
+                try:
+                    rides.extend((ride.date, ride.km) for ride in gpx.read(file))
+                except (gpx.ParseError, ValueError) as e:
+                    form.add_error('files', "{}: {}".format(file.name, e))
+            
+            if form.is_valid():
+                gpx.append(bicycle.id, rides)
+                return HttpResponseRedirect(reverse('myequis:bicycle', args=(bicycle.id,)))
+    else:
+        form = GpxForm()
+    
+    template = loader.get_template('myequis/gpx.html')
+    context = { 'bicycle': bicycle, 'form': form, 'available': gpx.available() }
+    return HttpResponse(template.render(context, request))
+
+# Materials mounted at a date, within a date range (until) or the changes between two dates (compare)
+# ex: ?date=2019-08-01&compare=2020-08-01
+def bicycle_configuration(request, bicycle_id):
+    
+    bicycle = get_object_or_404(Bicycle, pk=bicycle_id)
+    
+    form = ConfigurationForm(request.GET or {'date': timezone.localdate()})
+    context = { 'bicycle': bicycle, 'form': form }
+    
+    if form.is_valid():
+        day = form.cleaned_data['date']
+        until = form.cleaned_data['until']
+        compare = form.cleaned_data['compare']
+        
+        context['km'] = odometer.km_at(bicycle.id, day)
+        
+        if compare is not None:
+            context['changes'] = configuration.changes(bicycle.id, day, compare)
+        elif until is not None:
+            context['materials'] = configuration.mounted_during(bicycle.id, day, until)
+        else:
+            context['materials'] = configuration.mounted_at(bicycle.id, day)
+    
+    template = loader.get_template('myequis/configuration.html')
+    return HttpResponse(template.render(context, request))
+
+# ex: ?q=conti&unused=1, JSON with format=json
+def search_materials(request):
+    query = request.GET.get('q', '')
+    unused = bool(request.GET.get('unused'))
+    materials = search.search(query, unused=unused) if query else []
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'materials': [{
+            'id': material.id,
+            'name': material.name,
+            'manufactor': material.manufactor,
+            'size': material.size,
+            'part': material.part.display_long_name() if material.part else None,
+            'bicycle': material.mounted_in_bicycle(),
+        } for material in materials]})
+    
+    template = loader.get_template('myequis/search.html')
+    context = {
+        'query': query,
+        'unused': unused,
+        'materials': materials,
+    }
+    
+    return HttpResponse(template.render(context, request))
+
+# Rows created, updated or deleted since cursor, see sync.py
+# ex: ?cursor=2019-08-01T10:00:00.000000Z_3_1234&limit=100
+def sync_changes(request):
+    try:
+        limit = min(int(request.GET.get('limit', sync.LIMIT)), sync.LIMIT)
+        changes = sync.changes(request.GET.get('cursor'), max(limit, 1))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor or limit")
+    
+    return JsonResponse(changes, json_dumps_params={'separators': (',', ':')})
+
+# Odometer readings of bike computers as JSON, with an ingest token (see ingest.py)
+# ex: {"readings": [{"bicycle": 5, "date": "2019-08-01T17:30:00Z", "km": 1234}]}
+@csrf_exempt
+@require_POST
+def ingest_readings(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not authorization.startswith('Token ') or not ingest.authorized(authorization[len('Token '):]):
+        return JsonResponse({'error': "Invalid token"}, status=401)
+    
+    try:
+        readings = json.loads(request.body.decode('utf-8'))['readings']
+        if not isinstance(readings, list):
+            raise ValueError(readings)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': "A JSON object with a list of readings is required"}, status=400)
+    
+    if len(readings) > ingest.MAX_READINGS:
+        return JsonResponse({'error': "At most {} readings".format(ingest.MAX_READINGS)}, status=400)
+    
+    readings, errors = ingest.parse(readings)
+    created, updated, rejected = ingest.ingest(readings)
+    
+    return JsonResponse({
+        'created': created,
+        'updated': updated,
+        'errors': [{ 'index': index, 'error': error } for index, error in sorted(errors + rejected)],
+    })